@@ -1,18 +1,50 @@
 import asyncio
-import struct
+import math
+import time
+from collections import namedtuple
 import cv2
 import numpy as np
-import json
+from Tools.ingest import FrameQueue, read_frames, frame_scale, INGEST_DEPTH
+from Tools.protocol import encode_line, read_hello, RAW, FLAG_REPEAT
+from Tools.latency import LatencyStats
+from Tools.recording import Recorder
+from Tools.preview import Preview, PREVIEW_FPS
+from Tools.session import session_key
 
 HOST = "0.0.0.0"
 FRAME_PORT = 11000
 CONTROL_PORT = 11001
 
 DETECTION_THRESHOLD = 500
+# Directory to record every incoming frame stream to (see Tools/recording.py), or None
+RECORD_DIR = None
+# The line is searched for below this fraction of the frame height (bottom 40%)
+ROI_TOP = 0.6
+# Gray level below which a pixel counts as line
+DARK_THRESHOLD = 60
+# Line detector: "contour" finds the biggest dark blob and its centroid;
+# "scanline" only looks at SCANLINES rows of the ROI and also reports the
+# center on each row, the line's heading and its curvature
+LINE_ENGINE = "contour"
+SCANLINES = 8
+# Narrowest dark run on a scanline that counts as line (pixels)
+MIN_SEGMENT = 3
+# Skip all drawing and never open a window (for machines without a display).
+# Otherwise annotated frames go to a preview thread at up to PREVIEW_FPS.
+HEADLESS = False
 
-# Map client IP -> control writer (to send JSON detections)
+# Map session key (see Tools/session.py) -> control writer (to send detections)
 control_writers = {}
 
+# Preview windows (None when HEADLESS)
+preview = None
+
+stats = LatencyStats("LNFOL")
+
+# Scanline engine result: row centers [(x, y)] nearest first, heading in
+# radians (+ = line bends right ahead), curvature in 1/px (+ = curving right)
+LinePath = namedtuple("LinePath", "points heading curvature")
+
 async def handle_control_client(reader, writer):
     peer = writer.get_extra_info("peername")
     if not peer:
@@ -21,24 +53,215 @@ async def handle_control_client(reader, writer):
         return
     ip = peer[0]
     print(f"[CONTROL] Connected from {ip}")
-    control_writers[ip] = writer
+    # Legacy clients are known by IP only; session clients say who they are first
+    key = ip
+    control_writers[key] = writer
     try:
+        hello = await read_hello(reader)
+        if hello and hello.get("session"):
+            if control_writers.get(key) is writer:
+                del control_writers[key]
+            key = session_key(hello, ip)
+            control_writers[key] = writer
+            print(f"[CONTROL] Session {key}")
         # Keep connection open until client disconnects
         while True:
             data = await reader.read(100)  # we don't expect incoming data; just detect disconnect
             if not data:
                 break
-    except asyncio.IncompleteReadError:
+    except (asyncio.IncompleteReadError, ConnectionResetError):
         pass
     finally:
-        print(f"[CONTROL] Disconnected {ip}")
-        control_writers.pop(ip, None)
+        print(f"[CONTROL] Disconnected {key}")
+        # A reconnect of the same session may already have replaced this writer
+        if control_writers.get(key) is writer:
+            del control_writers[key]
         try:
             writer.close()
             await writer.wait_closed()
         except Exception:
             pass
 
+def decode_frame(data, stream="color"):
+    """Decode a frame payload for the negotiated stream mode.
+
+    Returns a BGR image for "color", a grayscale ROI image for "gray_roi"
+    (single-channel JPEG) and "raw_roi" (RAW header + packed 8-bit pixels),
+    or None if the payload is bad.
+    """
+    if stream == "raw_roi":
+        if len(data) < RAW.size:
+            return None
+        width, height = RAW.unpack_from(data)
+        if len(data) - RAW.size != width * height:
+            return None
+        return np.frombuffer(data, np.uint8, offset=RAW.size).reshape(height, width)
+    flags = cv2.IMREAD_GRAYSCALE if stream == "gray_roi" else cv2.IMREAD_COLOR
+    return cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+
+def process_frame(detect, data, hello=None, annotate=True):
+    """Decode a frame and run a line detection function on its ROI.
+
+    Color frames are cropped to the bottom ROI_TOP part here; ROI streams were
+    already cropped on the Pi, so their row offset comes from the hello.
+    Returns (frame, detections, (decode seconds, detect seconds)), with frame
+    None for a bad payload. The frame is the annotated full-size canvas if
+    annotate, else the decoded image as is.
+    """
+    hello = hello or {}
+    stream = hello.get("stream", "color")
+    start = time.perf_counter()
+    image = decode_frame(data, stream)
+    decoded = time.perf_counter()
+    if image is None:
+        return None, (None, None), (decoded - start, 0.0)
+
+    canvas = None
+    if stream == "color":
+        roi_offset = int(image.shape[0] * ROI_TOP)
+        roi = cv2.cvtColor(image[roi_offset:], cv2.COLOR_BGR2GRAY)
+        if annotate:
+            canvas = image
+    else:
+        roi = image
+        # roi_top is in full-frame pixels; the Pi may also have downscaled the ROI
+        roi_offset = int(round(hello.get("roi_top", 0) / frame_scale(hello, image.shape[1])))
+        if annotate:
+            canvas = np.zeros((roi_offset + roi.shape[0], roi.shape[1], 3), np.uint8)
+            canvas[roi_offset:] = roi[..., None]
+    found = detect(roi, roi_offset, canvas)
+    return canvas if annotate else image, found, (decoded - start, time.perf_counter() - decoded)
+
+def detect_line(roi, roi_offset, canvas=None):
+    """Find the line in a grayscale ROI that starts roi_offset rows into the frame.
+
+    Returns (line_center, error, None) in frame pixels, center and error None
+    when no line is found. Draws the result on canvas (the full frame) if
+    one is given.
+    """
+    # --- LINE DETECTION ---
+    blur = cv2.GaussianBlur(roi, (5, 5), 0)
+    _, mask = cv2.threshold(blur, DARK_THRESHOLD, 255, cv2.THRESH_BINARY_INV)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((5,5), np.uint8))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((5,5), np.uint8))
+    width = mask.shape[1]
+
+    # Find contours in the region of interest
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    line_center = None
+    largest = None
+    if contours:
+        # Find the largest contour — likely the main line
+        largest = max(contours, key=cv2.contourArea)
+        area = cv2.contourArea(largest)
+        if area > DETECTION_THRESHOLD:
+            M = cv2.moments(largest)
+            if M["m00"] != 0:
+                cx = int(M["m10"] / M["m00"])
+                cy = int(M["m01"] / M["m00"]) + roi_offset
+                line_center = (cx, cy)
+
+    # Compute steering error (distance from center)
+    error = None
+    if line_center:
+        frame_center = width // 2
+        error = frame_center - line_center[0]
+        if canvas is not None:
+            cv2.circle(canvas, line_center, 6, (0, 255, 0), -1)
+            cv2.drawContours(canvas, [largest + np.array([[0, roi_offset]])], -1, (255, 0, 0), 2)
+            cv2.line(canvas, (frame_center, 0), (frame_center, canvas.shape[0]), (0, 255, 255), 1)
+            cv2.putText(canvas, f"Error: {error}", (20, 40),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
+    return line_center, error, None
+
+def fit_path(us, xs):
+    """Least-squares x = a*v^2 + b*v + c with v = u - mean(u); returns (a, b, mean(u)).
+
+    Closed form on plain floats: with a handful of points this is much cheaper
+    than np.polyfit. Falls back to a straight line when three points don't
+    pin down a parabola.
+    """
+    n = len(us)
+    mean = sum(us) / n
+    vs = [u - mean for u in us]
+    s2 = sum(v * v for v in vs)
+    s3 = sum(v ** 3 for v in vs)
+    s4 = sum(v ** 4 for v in vs)
+    t0 = sum(xs)
+    t1 = sum(x * v for x, v in zip(xs, vs))
+    t2 = sum(x * v * v for x, v in zip(xs, vs))
+    if s2 == 0:
+        return 0.0, 0.0, mean
+    # Normal equations [[s4 s3 s2] [s3 s2 0] [s2 0 n]] . (a b c) = (t2 t1 t0), since sum(v) = 0
+    det = s4 * s2 * n - s3 * s3 * n - s2 ** 3
+    if n < 3 or abs(det) < 1e-9 * s4 * s2 * n:
+        return 0.0, t1 / s2, mean
+    a = (t2 * s2 * n - s3 * t1 * n - s2 * s2 * t0) / det
+    b = (t1 - s3 * a) / s2
+    return a, b, mean
+
+def detect_scanlines(roi, roi_offset, canvas=None):
+    """Find the line on SCANLINES rows of a grayscale ROI.
+
+    Each scanline is the mean of three neighbouring rows, thresholded with
+    NumPy; the dark run closest to the previous (nearer) row's center is the
+    line on that row. Returns (line_center, error, LinePath) like
+    detect_line, with line_center the mean of the row centers.
+    """
+    height, width = roi.shape
+    count = min(SCANLINES, height - 2)
+    if count < 2:
+        return None, None, None
+    # Nearest (bottom) row first
+    step = (height - 3) / (count - 1)
+    ys = [height - 2 - int(round(i * step)) for i in range(count)]
+    rows = np.array(ys)
+    bands = roi[rows - 1].astype(np.uint16)
+    bands += roi[rows]
+    bands += roi[rows + 1]
+    dark = np.zeros((count, width + 2), np.int8)
+    dark[:, 1:-1] = bands < 3 * DARK_THRESHOLD
+    # +1 where a dark run starts, -1 one past where it ends; runs come out in order
+    edges = np.diff(dark, axis=1)
+    hit_rows, hit_cols = np.nonzero(edges)
+    runs = [[] for _ in range(count)]
+    for row, col in zip(hit_rows.tolist(), hit_cols.tolist()):
+        runs[row].append(col)
+
+    points = []
+    previous = width / 2
+    for y, cols in zip(ys, runs):
+        centers = [(start + end - 1) / 2 for start, end in zip(cols[0::2], cols[1::2])
+                   if end - start >= MIN_SEGMENT]
+        if not centers:
+            continue
+        x = min(centers, key=lambda c: abs(c - previous))
+        points.append((int(round(x)), y + roi_offset))
+        previous = x
+    if len(points) < 2:
+        return None, None, None
+
+    xs = [float(x) for x, _ in points]
+    # Fit x against u = -y (distance ahead), so + means right / bending right
+    us = [-float(y) for _, y in points]
+    a, b, mean = fit_path(us, xs)
+    slope = 2 * a * (us[0] - mean) + b  # dx/du at the nearest row
+    heading = math.atan(slope)
+    curvature = 2 * a / (1 + slope * slope) ** 1.5
+
+    line_center = (int(round(sum(xs) / len(xs))), int(round(-sum(us) / len(us))))
+    frame_center = width // 2
+    error = frame_center - line_center[0]
+    if canvas is not None:
+        for point in points:
+            cv2.circle(canvas, point, 4, (0, 255, 0), -1)
+        cv2.polylines(canvas, [np.array(points, np.int32)], False, (255, 0, 0), 2)
+        cv2.line(canvas, (frame_center, 0), (frame_center, canvas.shape[0]), (0, 255, 255), 1)
+        cv2.putText(canvas, f"Error: {error} Heading: {math.degrees(heading):.0f}", (20, 40),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
+    return line_center, error, LinePath(points, heading, curvature)
+
 async def handle_frame_client(reader, writer):
     peer = writer.get_extra_info("peername")
     if not peer:
@@ -47,85 +270,90 @@ async def handle_frame_client(reader, writer):
         return
     ip = peer[0]
     print(f"[FRAME] Connected from {ip}")
+    key = window = None
+    # Keep draining the socket while a frame is being processed, so the next
+    # frame picked up is always the newest one
+    frames = FrameQueue(INGEST_DEPTH)
+    recorder = Recorder.for_client(RECORD_DIR, ip) if RECORD_DIR else None
+    ingest = asyncio.create_task(read_frames(reader, frames, stats, recorder))
+    detect = detect_scanlines if LINE_ENGINE == "scanline" else detect_line
+    last_line = (None, None, None)
     try:
     
         while True:
-            header = await reader.readexactly(4)
-            (frame_size,) = struct.unpack(">I", header)
-            data = await reader.readexactly(frame_size)
-            frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
-            if frame is None:
-                print("[FRAME] Received bad frame, skipping")
-                continue
-            # --- LINE DETECTION ---
-            # Convert to grayscale or HSV depending on your line color
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            blur = cv2.GaussianBlur(gray, (5, 5), 0)
-            _, mask = cv2.threshold(blur, 60, 255, cv2.THRESH_BINARY_INV)
-            mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((5,5), np.uint8))
-            mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((5,5), np.uint8))
-
-            # Focus on the bottom region of the frame (where the line usually is)
-            height, width = mask.shape
-            roi = mask[int(height * 0.6):, :]  # bottom 40%
-
-            # Find contours in the region of interest
-            contours, _ = cv2.findContours(roi, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-            line_center = None
-            if contours:
-                # Find the largest contour — likely the main line
-                largest = max(contours, key=cv2.contourArea)
-                area = cv2.contourArea(largest)
-                if area > DETECTION_THRESHOLD:
-                    M = cv2.moments(largest)
-                    if M["m00"] != 0:
-                        cx = int(M["m10"] / M["m00"])
-                        cy = int(M["m01"] / M["m00"]) + int(height * 0.6)
-                        line_center = (cx, cy)
-                        cv2.circle(frame, line_center, 6, (0, 255, 0), -1)
-                        cv2.drawContours(frame, [largest + np.array([[0, int(height * 0.6)]])], -1, (255, 0, 0), 2)
-
-            # Compute steering error (distance from center)
-            error = None
-            if line_center:
-                frame_center = width // 2
-                error = frame_center - line_center[0]
-                cv2.line(frame, (frame_center, 0), (frame_center, height), (0, 255, 255), 1)
-                cv2.putText(frame, f"Error: {error}", (20, 40),
-                            cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
-
-            writer_ctrl = control_writers.get(ip)
+            meta = await frames.get()
+            if meta is None:
+                print(f"[FRAME] Client {key or ip} disconnected.")
+                break
+            if key is None:
+                # The hello always arrives before the first frame
+                key = session_key(frames.hello, ip)
+                window = f"Feed {key}"
+                print(f"[FRAME] Session {key}")
+            wait_time = time.monotonic() - meta.received
+            if meta.flags & FLAG_REPEAT:
+                # The Pi skipped an unchanged frame: answer with the last detections
+                frame = None
+                line_center, error, path = last_line
+                timings = (wait_time, 0.0, 0.0)
+            else:
+                # Detection runs in a thread so the ingest task keeps reading
+                frame, (line_center, error, path), (decode_time, detect_time) = await asyncio.to_thread(
+                    process_frame, detect, meta.data, frames.hello, not HEADLESS)
+                timings = (wait_time, decode_time, detect_time)
+                stats.record("wait", wait_time)
+                stats.record("decode", decode_time)
+                stats.record("detect", detect_time)
+                if frame is None:
+                    print("[FRAME] Received bad frame, skipping")
+                    continue
+                scale = frame_scale(frames.hello, frame.shape[1])
+                if scale != 1.0 and line_center is not None:
+                    line_center = (int(round(line_center[0] * scale)), int(round(line_center[1] * scale)))
+                    error = int(round(error * scale))
+                    if path is not None:
+                        path = LinePath([(int(round(x * scale)), int(round(y * scale))) for x, y in path.points],
+                                        path.heading, path.curvature / scale)
+                last_line = (line_center, error, path)
+
+            writer_ctrl = control_writers.get(key)
             if writer_ctrl:
-                payload = json.dumps({
-                    "line_center": line_center,
-                    "error": error
-                })
+                binary = frames.hello.get("protocol") == "binary"
                 try:
-                    writer_ctrl.write(struct.pack(">I", len(payload)) + payload.encode())
+                    start = time.monotonic()
+                    writer_ctrl.write(encode_line(meta.seq, meta.capture_time, line_center, error, binary, timings, path))
                     await writer_ctrl.drain()
+                    stats.record("reply", time.monotonic() - start)
                 except Exception as e:
-                    print(f"[CONTROL] Failed to send to {ip}: {e}")
-                    control_writers.pop(ip, None)
+                    print(f"[CONTROL] Failed to send to {key}: {e}")
+                    if control_writers.get(key) is writer_ctrl:
+                        del control_writers[key]
+            stats.maybe_report()
 
-
-            # Display for debug
-            cv2.imshow(f"Feed {ip}", frame)
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                print("User requested exit (q).")
+            # Display for debug; the preview thread does the drawing
+            if preview is None:
+                continue
+            if frame is not None:
+                preview.show(window, frame)
+            if preview.quit_requested(window):
                 break
 
-    except asyncio.IncompleteReadError:
-        print(f"[FRAME] Client {ip} disconnected.")
     finally:
+        print(f"[FRAME] {key or ip}: {frames.received} frames received, {frames.dropped} stale frames dropped")
+        ingest.cancel()
         try:
             writer.close()
             await writer.wait_closed()
         except Exception:
             pass
-        cv2.destroyAllWindows()
+        if preview is not None and window is not None:
+            preview.close(window)
 
 async def main():
+    global preview
+    if not HEADLESS:
+        preview = Preview(PREVIEW_FPS)
+        preview.start()
     frame_server = await asyncio.start_server(handle_frame_client, HOST, FRAME_PORT)
     control_server = await asyncio.start_server(handle_control_client, HOST, CONTROL_PORT)
     
@@ -134,4 +362,8 @@ async def main():
     print(f"Frame server listening on {addr1}")
     print(f"Control server listening on {addr2}")
     async with frame_server, control_server:
-        await asyncio.gather(frame_server.serve_forever(), control_server.serve_forever())
\ No newline at end of file
+        try:
+            await asyncio.gather(frame_server.serve_forever(), control_server.serve_forever())
+        finally:
+            if preview is not None:
+                preview.stop()
\ No newline at end of file
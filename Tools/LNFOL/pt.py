@@ -1,28 +1,83 @@
 import asyncio
-import struct
-import cv2
-import numpy as np
-import json
-from pitop import Camera
+import math
+import time
+from Tools.protocol import read_message, encode_hello, RAW
+from Tools.latency import LatencyStats, record_reply
+from Tools.broker import open_camera
+from Tools.sender import FrameSender, FlightWindow, encode_jpeg
+from Tools.bitrate import BitrateController
+from Tools.session import new_session_id
+from Tools.LNFOL.steering import LineFollower
+from Tools.startup import LazyDevice, lazy_import, preload
 
-SERVER_IP = "10.0.21.21" if input("Use default IP? (y/n): ") == "y" else input("Enter your PC IP: ")
+# Loaded on first use, so startup goes straight to connecting (see startup.py)
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+robotics = lazy_import("pitop.robotics")
+
+SERVER_IP = "10.0.21.21"
 FRAME_PORT = 11000
 CONTROL_PORT = 11001
+# Detection reply format requested from the server ("binary" or "json")
+PROTOCOL = "binary"
+# What goes on the wire: "color" full JPEG, "gray_roi" grayscale JPEG of the
+# bottom ROI only, or "raw_roi" packed grayscale ROI pixels (fast LANs)
+STREAM_MODE = "gray_roi"
+# Must match the server's ROI_TOP; rows above this fraction are never sent
+ROI_TOP = 0.6
+# Steer the robot from the detections (see steering.py); False only prints them
+STEERING = True
+
+FRAME_SIZE = (640, 480)
+
+# Shared through the hardware broker when it runs (see Tools/broker.py)
+cam = LazyDevice(lambda: open_camera(FRAME_SIZE), "camera")
+drive = LazyDevice(lambda: robotics.DriveController(left_motor_port="M1", right_motor_port="M0"), "drive")
+
+def new_run():
+    """Fresh per-connection state; each run calls it, as the agent reuses this module."""
+    global stats, sent_times, bitrate, window, SESSION
+    stats = LatencyStats("LNFOL PI")
+    # Frame seq -> time it finished sending, matched against replies
+    sent_times = {}
+    # Adapts JPEG quality, resolution and frame rate to drain stalls and reply round trips
+    bitrate = BitrateController(name="LNFOL")
+    # Frames allowed to wait for their reply at once, sized from the round trip
+    window = FlightWindow(name="LNFOL")
+    # Identifies this robot's frame and control connections to the server
+    SESSION = new_session_id()
+
+new_run()
+
+def gray_roi(rgb, scale):
+    """Crop an RGB frame to the line ROI, convert it to grayscale and downscale it."""
+    frame = np.asarray(rgb)
+    roi = cv2.cvtColor(frame[int(frame.shape[0] * ROI_TOP):], cv2.COLOR_RGB2GRAY)
+    if scale < 1.0:
+        roi = cv2.resize(roi, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return roi
+
+def encode_gray_roi(rgb, quality, scale=1.0):
+    ok, jpeg = cv2.imencode(".jpg", gray_roi(rgb, scale), [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    return jpeg.tobytes() if ok else None
 
-cam = Camera(resolution=(640, 480))
+def encode_raw_roi(rgb, quality, scale=1.0):
+    roi = gray_roi(rgb, scale)
+    return RAW.pack(roi.shape[1], roi.shape[0]) + roi.tobytes()
 
 async def send_frames(frame_writer):
+    hello = {
+        "protocol": PROTOCOL,
+        "frame_size": FRAME_SIZE,
+        "stream": STREAM_MODE,
+        "roi_top": int(FRAME_SIZE[1] * ROI_TOP),
+        "session": SESSION,
+    }
+    encoder = {"gray_roi": encode_gray_roi, "raw_roi": encode_raw_roi}.get(STREAM_MODE, encode_jpeg)
+    sender = FrameSender(cam, frame_writer, hello, stats=stats, sent_times=sent_times,
+                         controller=bitrate, window=window, encoder=encoder)
     try:
-        frame = np.array(cam.get_frame())
-        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-        ok, jpeg = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), 80])
-        if not ok:
-            await asyncio.sleep(0.03)
-        data = jpeg.tobytes()
-        frame_writer.write(struct.pack(">I", len(data)) + data)
-        await frame_writer.drain()
-        await asyncio.sleep(0.03)
-        return frame
+        await sender.run()
     except (ConnectionResetError, asyncio.IncompleteReadError):
         print("[FRAME CLIENT] Connection lost")
     finally:
@@ -32,31 +87,47 @@ async def send_frames(frame_writer):
         except Exception:
             pass
 
-async def receive_detections(control_reader):
+async def receive_detections(control_reader, follower=None):
     try:
-        header = await control_reader.readexactly(4)
-        (msg_len,) = struct.unpack(">I", header)
-        payload = await control_reader.readexactly(msg_len)
-        data = json.loads(payload.decode())
-        if data.get("line_center") and data.get("error"):
-            print(f"Line center at: {data['line_center']}, Error: {data['error']}")
+        while True:
+            data = await read_message(control_reader)
+            record_reply(stats, data, sent_times)
+            if data.get("seq") is not None:
+                window.ack(data["seq"])
+            if data.get("capture_time"):
+                bitrate.observe_rtt(time.monotonic() - data["capture_time"])
+            if follower is not None:
+                follower.observe(data)
+            if data.get("line_center") and data.get("error"):
+                print(f"Frame {data.get('seq')}: line center at: {data['line_center']}, Error: {data['error']}")
+            if data.get("heading") is not None:
+                print(f"  heading {math.degrees(data['heading']):.1f} deg, curvature {data['curvature']:.5f}/px")
     except asyncio.IncompleteReadError:
         print("[CONTROL CLIENT] Server closed control connection")
     finally:
-        pass
+        if follower is not None:
+            follower.stop()
 
-async def main():
+async def main(ip=SERVER_IP):
+    new_run()
+    # Open the camera and motors and load OpenCV while the connections come up
+    cam.warm()
+    if STEERING:
+        drive.warm()
+    preload("numpy", "cv2")
     print("Connecting frame channel...")
-    reader_f, writer_f = await asyncio.open_connection(SERVER_IP, FRAME_PORT)
+    reader_f, writer_f = await asyncio.open_connection(ip, FRAME_PORT)
     print("Connecting control channel...")
-    reader_c, writer_c = await asyncio.open_connection(SERVER_IP, CONTROL_PORT)
-    print("Both channels connected. Streaming...")
+    reader_c, writer_c = await asyncio.open_connection(ip, CONTROL_PORT)
+    writer_c.write(encode_hello({"session": SESSION}))
+    await writer_c.drain()
+    print(f"Both channels connected (session {SESSION}). Streaming...")
 
     # Keep writer_c alive (server expects control connection to remain open).
-    # We don't send anything on it, but keeping the writer prevents server from closing.
-    while True:
-        detections = await asyncio.gather(
-            send_frames(writer_f),
-            receive_detections(reader_c)
-        )
-        return detections
+    # Beyond the session hello we don't send anything on it.
+    # The control loop steers at its own fixed rate from the newest detection.
+    follower = LineFollower(drive, FRAME_SIZE[0]) if STEERING else None
+    tasks = [send_frames(writer_f), receive_detections(reader_c, follower)]
+    if follower is not None:
+        tasks.append(follower.run())
+    await asyncio.gather(*tasks)
@@ -0,0 +1,128 @@
+"""Closed-loop line following on the Pi.
+
+Detections arrive whenever the network and the server deliver them;
+LineFollower just remembers the newest one. A separate loop runs at
+CONTROL_HZ, estimates where the line is *now*, and drives the robot:
+
+  - the error is normalized to -1..1 (line at the left / right frame edge)
+  - each detection is stamped with its frame's capture time (same Pi clock),
+    so the loop extrapolates the error over the detection's age using the
+    error's recent rate of change (at most MAX_EXTRAPOLATION seconds)
+  - a PID on that error, plus HEADING_GAIN x the line heading when the
+    server's scanline engine reports one, sets the angular speed; the
+    linear speed drops as the turn gets sharper
+  - if no line has been seen for DEADMAN_TIMEOUT seconds the robot stops
+
+DriveController.robot_move turns (linear, angular) into the two wheel speeds.
+"""
+import time
+
+from Tools.sender import Pacer
+
+CONTROL_HZ = 20
+BASE_SPEED = 0.15  # m/s on a straight line
+MIN_SPEED = 0.05  # m/s in the sharpest turns
+MAX_ANGULAR = 1.5  # rad/s, positive turns left
+# PID gains on the normalized error, output in rad/s
+KP = 1.2
+KI = 0.1
+KD = 0.15
+INTEGRAL_LIMIT = 0.5
+# rad/s per radian of line heading (look-ahead from the scanline engine)
+HEADING_GAIN = 0.8
+# Weight of the newest error rate in its running estimate
+RATE_GAIN = 0.5
+# Never extrapolate a detection further than this (seconds)
+MAX_EXTRAPOLATION = 0.25
+# Stop when the newest line detection is older than this (seconds)
+DEADMAN_TIMEOUT = 0.5
+
+
+class PID:
+    def __init__(self, kp=KP, ki=KI, kd=KD, integral_limit=INTEGRAL_LIMIT):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.integral_limit = integral_limit
+        self.integral = 0.0
+
+    def reset(self):
+        self.integral = 0.0
+
+    def update(self, error, rate, dt):
+        """Control output for an error, its rate of change (per second) and the time step."""
+        self.integral += error * dt
+        self.integral = max(-self.integral_limit, min(self.integral_limit, self.integral))
+        return self.kp * error + self.ki * self.integral + self.kd * rate
+
+
+class LineFollower:
+    """Steers a DriveController from streamed line detections at a fixed rate."""
+
+    def __init__(self, drive, frame_width, hz=CONTROL_HZ, pid=None):
+        self.drive = drive
+        self.half_width = frame_width / 2
+        self.hz = hz
+        self.pid = pid or PID()
+        self.error = None  # normalized error of the newest detection
+        self.rate = 0.0  # normalized error change per second
+        self.heading = None
+        self.captured = None  # capture time of the newest detection
+        self.moving = False
+        self.running = False
+
+    def observe(self, data):
+        """Take a decoded detection message from the control channel."""
+        if data.get("error") is None:
+            # No line in that frame: keep steering on the last one until the deadman trips
+            return
+        captured = data.get("capture_time") or time.monotonic()  # legacy replies have no timestamp
+        if self.captured is not None and captured <= self.captured:
+            return  # older than what we already have
+        error = data["error"] / self.half_width
+        if self.error is not None:
+            rate = (error - self.error) / (captured - self.captured)
+            self.rate += RATE_GAIN * (rate - self.rate)
+        self.error = error
+        self.heading = data.get("heading")
+        self.captured = captured
+
+    def command(self, now, dt):
+        """(linear, angular) speeds for this tick, or None to stop."""
+        if self.captured is None or now - self.captured > DEADMAN_TIMEOUT:
+            return None
+        age = min(now - self.captured, MAX_EXTRAPOLATION)
+        error = max(-1.0, min(1.0, self.error + self.rate * age))
+        angular = self.pid.update(error, self.rate, dt)
+        if self.heading is not None:
+            angular -= HEADING_GAIN * self.heading
+        angular = max(-MAX_ANGULAR, min(MAX_ANGULAR, angular))
+        linear = max(MIN_SPEED, BASE_SPEED * (1 - abs(angular) / MAX_ANGULAR))
+        return linear, angular
+
+    async def run(self):
+        """Control loop; runs until stop() is called."""
+        self.running = True
+        pacer = Pacer(self.hz)
+        last = time.monotonic()
+        print(f"[STEER] Control loop at {self.hz} Hz")
+        try:
+            while self.running:
+                await pacer.wait_async()
+                now = time.monotonic()
+                dt, last = now - last, now
+                command = self.command(now, dt)
+                if command is None:
+                    if self.moving:
+                        print("[STEER] No fresh line detections, stopping")
+                        self.drive.stop()
+                        self.pid.reset()
+                        self.moving = False
+                    continue
+                self.drive.robot_move(*command)
+                self.moving = True
+        finally:
+            self.drive.stop()
+
+    def stop(self):
+        self.running = False
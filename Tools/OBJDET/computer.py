@@ -1,14 +1,50 @@
 import asyncio
-import struct
+import math
+import os
+import time
 import cv2
 import numpy as np
-import json
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from Tools.OBJDET.colorlut import build_lut, classify, find_objects
+from Tools.OBJDET.tracker import Tracker
+from Tools.ingest import FrameQueue, read_frames, frame_scale, INGEST_DEPTH
+from Tools.protocol import encode_objects, read_hello, FLAG_REPEAT
+from Tools.latency import LatencyStats
+from Tools.recording import Recorder
+from Tools.preview import Preview, PREVIEW_FPS
+from Tools.session import FairScheduler, session_key
 
 HOST = "0.0.0.0"
 FRAME_PORT = 11000
 CONTROL_PORT = 11001
 
+# Minimum object area in pixels; a session can ask for another in its hello
 DETECTION_THRESHOLD = 500
+# Directory to record every incoming frame stream to (see Tools/recording.py), or None
+RECORD_DIR = None
+# Skip all drawing and never open a window (for machines without a display).
+# Otherwise annotated frames go to a preview thread at up to PREVIEW_FPS.
+HEADLESS = False
+
+# Detection engine: "single" runs one HSV isolation pass per color, "lut"
+# labels every color in one pass using a lookup table. Either way a session
+# gets the colors named in its hello, or all of COLOR_RANGES.
+ENGINE = "lut"
+
+# Follow objects across frames (stable IDs in the replies) and only search
+# padded windows around them, with a periodic full-frame rescan (see tracker.py)
+TRACKING = True
+
+# Where frames get processed: "inline" runs detection on the event loop,
+# "thread" / "process" hand the JPEG bytes to a worker pool so the frame
+# handler only does socket I/O.
+PROCESSING_MODE = "thread"
+WORKERS = os.cpu_count() or 1
+# Frames allowed inside the pool per connection. A frame is only taken from
+# the ingest queue once one of these slots is free; until then newer frames
+# replace it there. All sessions share the WORKERS workers, taking turns, and
+# each keeps at most one job waiting for a worker (see Tools/session.py).
+MAX_IN_FLIGHT = WORKERS
 # ROYGBV HSV ranges (OpenCV H: 0-180, S:0-255, V:0-255)
 COLOR_RANGES = {
     "red": [
@@ -39,9 +75,135 @@ COLOR_RANGES = {
     ],
 }
 
-# Map client IP -> control writer (to send JSON detections)
+# Built on first use (per process when using a process pool)
+color_lut = None
+
+# Map session key (see Tools/session.py) -> control writer (to send detections)
 control_writers = {}
 
+# Worker pool shared by all frame connections (None when PROCESSING_MODE is "inline")
+executor = None
+# Shares the pool's workers fairly between sessions
+scheduler = None
+
+# Preview windows (None when HEADLESS)
+preview = None
+
+stats = LatencyStats("OBJDET")
+
+def make_executor(mode=PROCESSING_MODE, workers=WORKERS):
+    """Create the worker pool for the given processing mode."""
+    if mode == "thread":
+        return ThreadPoolExecutor(max_workers=workers)
+    if mode == "process":
+        return ProcessPoolExecutor(max_workers=workers)
+    if mode == "inline":
+        return None
+    raise ValueError(f"Unknown processing mode: {mode}")
+
+async def run_detection(key, func, *args):
+    """Run a detection function for a session on the worker pool (or inline if there is none)."""
+    if scheduler is None:
+        return func(*args)
+    return await scheduler.submit(key, func, *args)
+
+def process_frame(detect, data, *args):
+    """Decode a JPEG frame and run a detection function on it.
+
+    Returns (annotated frame, detections, (decode seconds, detect seconds)),
+    with frame None for a bad JPEG. Kept at module level so it can be
+    shipped to a process pool.
+    """
+    start = time.perf_counter()
+    frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    decoded = time.perf_counter()
+    if frame is None:
+        return None, {}, (decoded - start, 0.0)
+    found = detect(frame, *args)
+    return frame, found, (decoded - start, time.perf_counter() - decoded)
+
+def detect_color(frame, color, annotate=True, threshold=DETECTION_THRESHOLD):
+    """Find objects of one color in a BGR frame, drawing their boxes on it if annotate.
+
+    Returns {color: [(x, y, w, h), ...]}.
+    """
+    ranges = COLOR_RANGES[color]
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    mask = cv2.inRange(hsv, ranges[0], ranges[1])
+    if len(ranges) == 4:
+        # Red wraps around the hue axis, so it needs a second range
+        mask = cv2.bitwise_or(mask, cv2.inRange(hsv, ranges[2], ranges[3]))
+    mask = cv2.medianBlur(mask, 5)
+    mask = cv2.erode(mask, None, iterations=1)
+    mask = cv2.dilate(mask, None, iterations=1)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=1)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=1)
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    obj_found = []
+    for cnt in contours:
+        area = cv2.contourArea(cnt)
+        if area > threshold:
+            x, y, w, h = cv2.boundingRect(cnt)
+            obj_found.append((int(x), int(y), int(w), int(h)))
+            if annotate:
+                cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+    return {color: obj_found}
+
+def detect_colors(frame, annotate=True, colors=None, threshold=DETECTION_THRESHOLD):
+    """Run detect_color for each of several colors (default: all of COLOR_RANGES)."""
+    found = {}
+    for color in colors or COLOR_RANGES:
+        found.update(detect_color(frame, color, annotate, threshold))
+    return found
+
+def detect_all_colors(frame, annotate=True, colors=None, threshold=DETECTION_THRESHOLD):
+    """Find objects of every color in COLOR_RANGES (or just colors) in a BGR frame.
+
+    Same return shape as detect_color, with an entry for each color.
+    """
+    global color_lut
+    if color_lut is None:
+        color_lut = build_lut(COLOR_RANGES)
+    names, lut = color_lut
+
+    found = find_objects(classify(frame, lut), names, threshold, wanted=colors)
+    if annotate:
+        draw_objects(frame, found)
+    return found
+
+def draw_objects(frame, found):
+    for name, boxes in found.items():
+        for x, y, w, h in boxes:
+            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+            cv2.putText(frame, name, (x, y - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+
+def detect_in_windows(frame, windows, full_width, detect, annotate, colors, threshold):
+    """Run a detection function only inside tracker search windows.
+
+    windows is [(color, (x0, y0, x1, y1))] in full-frame pixels (full_width
+    wide), or None to search the whole frame. Returns boxes in frame pixels
+    like the detection functions themselves.
+    """
+    if windows is None:
+        return detect(frame, annotate, colors, threshold)
+    scale = full_width / frame.shape[1] if full_width else 1.0
+    found = {color: [] for color in colors or COLOR_RANGES}
+    for color, (x0, y0, x1, y1) in windows:
+        x0, y0 = int(x0 / scale), int(y0 / scale)
+        x1, y1 = int(math.ceil(x1 / scale)), int(math.ceil(y1 / scale))
+        crop = frame[y0:y1, x0:x1]
+        if crop.size == 0:
+            continue
+        for x, y, w, h in detect(crop, False, (color,), threshold).get(color, []):
+            found[color].append((x + x0, y + y0, w, h))
+        if annotate:
+            cv2.rectangle(frame, (x0, y0), (x1, y1), (128, 128, 128), 1)
+    if annotate:
+        draw_objects(frame, found)
+    return found
+
 async def handle_control_client(reader, writer):
     peer = writer.get_extra_info("peername")
     if not peer:
@@ -50,32 +212,48 @@ async def handle_control_client(reader, writer):
         return
     ip = peer[0]
     print(f"[CONTROL] Connected from {ip}")
-    control_writers[ip] = writer
+    # Legacy clients are known by IP only; session clients say who they are first
+    key = ip
+    control_writers[key] = writer
     try:
+        hello = await read_hello(reader)
+        if hello and hello.get("session"):
+            if control_writers.get(key) is writer:
+                del control_writers[key]
+            key = session_key(hello, ip)
+            control_writers[key] = writer
+            print(f"[CONTROL] Session {key}")
         # Keep connection open until client disconnects
         while True:
             data = await reader.read(100)  # we don't expect incoming data; just detect disconnect
             if not data:
                 break
-    except asyncio.IncompleteReadError:
+    except (asyncio.IncompleteReadError, ConnectionResetError):
         pass
     finally:
-        print(f"[CONTROL] Disconnected {ip}")
-        control_writers.pop(ip, None)
+        print(f"[CONTROL] Disconnected {key}")
+        # A reconnect of the same session may already have replaced this writer
+        if control_writers.get(key) is writer:
+            del control_writers[key]
         try:
             writer.close()
             await writer.wait_closed()
         except Exception:
             pass
 
-async def handle_frame_client(reader, writer):
-    color = input("Enter color to detect (red, orange, yellow, green, blue, violet): ").strip().lower()
-    lower1, upper1 = COLOR_RANGES[color][0], COLOR_RANGES[color][1]
-    print(f"Detecting color range: lower1={lower1}, upper1={upper1}")
-    if color == "red":
-        lower2, upper2 = COLOR_RANGES[color][2], COLOR_RANGES[color][3]
-        print(f"Detecting extra red range: lower2={lower2}, upper2={upper2}")
+def session_detector(hello):
+    """Pick the detection function and its arguments for a session's hello."""
+    colors = [c for c in hello.get("colors") or COLOR_RANGES if c in COLOR_RANGES]
+    unknown = set(hello.get("colors") or ()) - set(COLOR_RANGES)
+    if unknown:
+        print(f"[FRAME] Ignoring unknown colors: {', '.join(sorted(unknown))}")
+    colors = colors or list(COLOR_RANGES)
+    threshold = int(hello.get("threshold") or DETECTION_THRESHOLD)
+    print(f"[FRAME] Detecting {', '.join(colors)} (min area {threshold}, {ENGINE} engine)")
+    detect = detect_all_colors if ENGINE == "lut" else detect_colors
+    return detect, (not HEADLESS, tuple(colors), threshold)
 
+async def handle_frame_client(reader, writer):
     peer = writer.get_extra_info("peername")
     if not peer:
         writer.close()
@@ -83,70 +261,145 @@ async def handle_frame_client(reader, writer):
         return
     ip = peer[0]
     print(f"[FRAME] Connected from {ip}")
-    try:
-    
+    key = ip
+    window = None
+
+    # Detections are queued as tasks in arrival order and awaited in the same
+    # order, so replies stay in frame order even when workers finish out of order.
+    pending = asyncio.Queue(maxsize=MAX_IN_FLIGHT)
+    # Taken before a frame leaves the ingest queue, given back once its detection is done
+    slots = asyncio.Semaphore(MAX_IN_FLIGHT)
+
+    async def send_results():
+        stopped = False
+        last_colors = {}
+        last_tracks = [] if tracker is not None else None
         while True:
-            header = await reader.readexactly(4)
-            (frame_size,) = struct.unpack(">I", header)
-            data = await reader.readexactly(frame_size)
-            frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
-            if frame is None:
-                print("[FRAME] Received bad frame, skipping")
+            item = await pending.get()
+            if item is None:
+                break
+            meta, dispatched, task, full = item
+            if task is None:
+                # The Pi skipped an unchanged frame: answer with the last detections
+                slots.release()
+                frame, colors, tracks = None, last_colors, last_tracks
+                timings = (dispatched - meta.received, 0.0, 0.0)
+            else:
+                try:
+                    frame, colors, (decode_time, detect_time) = await task
+                except asyncio.CancelledError:
+                    if not task.cancelled():
+                        raise
+                    # Replaced by a newer frame, or the session ended
+                    if tracker is not None and full:
+                        tracker.rescan = True  # the skipped full scan still has to happen
+                    continue
+                finally:
+                    slots.release()
+                timings = (dispatched - meta.received, decode_time, detect_time)
+                stats.record("wait", timings[0])
+                stats.record("decode", decode_time)
+                stats.record("detect", detect_time)
+                if frame is None:
+                    print("[FRAME] Received bad frame, skipping")
+                    continue
+                scale = frame_scale(frames.hello, frame.shape[1])
+                if scale != 1.0:
+                    colors = {color: [tuple(int(round(v * scale)) for v in box) for box in boxes]
+                              for color, boxes in colors.items()}
+                last_colors = colors
+                tracks = None
+                if tracker is not None:
+                    tracks = last_tracks = tracker.update(meta.seq, colors, full)
+                    if frame is not None and preview is not None:
+                        for track_id, _, (x, y, _, _) in tracks:
+                            cv2.putText(frame, f"#{track_id}", (int(x / scale), int(y / scale) + 15),
+                                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+            if stopped:
+                # Keep draining so the reader never blocks on a full queue
                 continue
 
-            # Detect purple objects
-            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-            if color == "red":
-                mask1 = cv2.inRange(hsv, lower1, upper1)
-                mask2 = cv2.inRange(hsv, lower2, upper2)
-                mask = cv2.bitwise_or(mask1, mask2)
-            else:
-                mask = cv2.inRange(hsv, lower1, upper1)
-            mask = cv2.medianBlur(mask, 5)
-            mask = cv2.erode(mask, None, iterations=1)
-            mask = cv2.dilate(mask, None, iterations=1)
-            kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-            mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=1)
-            mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=1)
-
-            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            obj_found = []
-            for cnt in contours:
-                area = cv2.contourArea(cnt)
-                if area > DETECTION_THRESHOLD:
-                    x, y, w, h = cv2.boundingRect(cnt)
-                    obj_found.append((int(x), int(y), int(w), int(h)))
-                    cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-
-            # Send detection JSON back on control channel if available
-            writer_ctrl = control_writers.get(ip)
+            # Send detections back on the session's control channel if available,
+            # tagged with the frame they came from (binary unless the client asked for JSON)
+            writer_ctrl = control_writers.get(key)
             if writer_ctrl:
-                payload = json.dumps({"objects": obj_found})
+                binary = frames.hello.get("protocol") == "binary"
                 try:
-                    writer_ctrl.write(struct.pack(">I", len(payload)) + payload.encode())
+                    start = time.monotonic()
+                    writer_ctrl.write(encode_objects(meta.seq, meta.capture_time, colors, binary, timings, tracks))
                     await writer_ctrl.drain()
+                    stats.record("reply", time.monotonic() - start)
                 except Exception as e:
                     # If send fails, remove writer (client likely disconnected)
-                    print(f"[CONTROL] Failed to send to {ip}: {e}")
-                    control_writers.pop(ip, None)
+                    print(f"[CONTROL] Failed to send to {key}: {e}")
+                    if control_writers.get(key) is writer_ctrl:
+                        del control_writers[key]
+            stats.maybe_report()
 
-            # Display for debug
-            cv2.imshow(f"Feed {ip}", frame)
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                print("User requested exit (q).")
-                break
+            # Display for debug; the preview thread does the drawing
+            if preview is None:
+                continue
+            if frame is not None:
+                preview.show(window, frame)
+            if preview.quit_requested(window):
+                stopped = True
+                writer.close()
 
-    except asyncio.IncompleteReadError:
-        print(f"[FRAME] Client {ip} disconnected.")
+    frames = FrameQueue(INGEST_DEPTH)
+    recorder = Recorder.for_client(RECORD_DIR, ip) if RECORD_DIR else None
+    ingest = asyncio.create_task(read_frames(reader, frames, stats, recorder))
+    tracker = Tracker() if TRACKING else None
+    sender = None
+    try:
+        await slots.acquire()
+        meta = await frames.get()
+        if meta is not None:
+            # The hello always arrives before the first frame
+            key = session_key(frames.hello, ip)
+            window = f"Feed {key}"
+            print(f"[FRAME] Session {key}")
+            detect, args = session_detector(frames.hello)
+            full_width = (frames.hello.get("frame_size") or (None,))[0]
+            sender = asyncio.create_task(send_results())
+        while meta is not None:
+            task = None
+            windows = None
+            if not meta.flags & FLAG_REPEAT:
+                if tracker is None:
+                    job = (process_frame, detect, meta.data, *args)
+                else:
+                    windows = tracker.plan(meta.seq)
+                    job = (process_frame, detect_in_windows, meta.data, windows, full_width, detect, *args)
+                task = asyncio.ensure_future(run_detection(key, *job))
+            await pending.put((meta, time.monotonic(), task, windows is None))
+            # Wait for a free slot first, so the frame taken is the newest one
+            await slots.acquire()
+            meta = await frames.get()
+        print(f"[FRAME] Session {key} disconnected.")
     finally:
+        print(f"[FRAME] {key}: {frames.received} frames received, {frames.dropped} stale frames dropped")
+        ingest.cancel()
+        if scheduler is not None:
+            scheduler.forget(key)
+        if sender is not None:
+            await pending.put(None)
+            await sender
         try:
             writer.close()
             await writer.wait_closed()
         except Exception:
             pass
-        cv2.destroyAllWindows()
+        if preview is not None and window is not None:
+            preview.close(window)
 
 async def main():
+    global executor, scheduler, preview
+    executor = make_executor()
+    if executor is not None:
+        scheduler = FairScheduler(executor, WORKERS)
+    if not HEADLESS:
+        preview = Preview(PREVIEW_FPS)
+        preview.start()
     frame_server = await asyncio.start_server(handle_frame_client, HOST, FRAME_PORT)
     control_server = await asyncio.start_server(handle_control_client, HOST, CONTROL_PORT)
     
@@ -155,4 +408,10 @@ async def main():
     print(f"Frame server listening on {addr1}")
     print(f"Control server listening on {addr2}")
     async with frame_server, control_server:
-        await asyncio.gather(frame_server.serve_forever(), control_server.serve_forever())
+        try:
+            await asyncio.gather(frame_server.serve_forever(), control_server.serve_forever())
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+            if preview is not None:
+                preview.stop()
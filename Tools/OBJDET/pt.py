@@ -1,31 +1,60 @@
 import asyncio
-import struct
-import cv2
-import numpy as np
-import json
-from pitop import Camera
+import time
+from Tools.broker import open_camera
+from Tools.protocol import read_message, encode_hello
+from Tools.latency import LatencyStats, record_reply
+from Tools.sender import FrameSender, FlightWindow, ChangeGate
+from Tools.bitrate import BitrateController
+from Tools.session import new_session_id
+from Tools.startup import LazyDevice, preload
 FRAME_PORT = 11000
 CONTROL_PORT = 11001
+# Detection reply format requested from the server ("binary" or "json")
+PROTOCOL = "binary"
+# Skip near-duplicate frames while the robot is stationary (the server reuses
+# its last detections for them)
+CHANGE_GATE = True
+# Colors the server should look for (None = all it knows) and the minimum
+# object area in pixels (None = server default)
+COLORS = None
+DETECTION_THRESHOLD = None
 
-cam = Camera(resolution=(640, 480))
+FRAME_SIZE = (640, 480)
+
+# Shared through the hardware broker when it runs (see Tools/broker.py); opened
+# on first use so importing this module stays cheap
+cam = LazyDevice(lambda: open_camera(FRAME_SIZE), "camera")
+
+
+def new_run():
+    """Fresh per-connection state; each run calls it, as the agent reuses this module."""
+    global stats, sent_times, bitrate, window, SESSION
+    stats = LatencyStats("OBJDET PI")
+    # Frame seq -> time it finished sending, matched against replies
+    sent_times = {}
+    # Adapts JPEG quality, resolution and frame rate to drain stalls and reply round trips
+    bitrate = BitrateController(name="OBJDET")
+    # Frames allowed to wait for their reply at once, sized from the round trip
+    window = FlightWindow(name="OBJDET")
+    # Identifies this robot's frame and control connections to the server
+    SESSION = new_session_id()
+
+
+new_run()
 
 
 async def send_frames(frame_writer, keepalive=True):
     """Continuously capture and send frames to the server."""
+    hello = {"protocol": PROTOCOL, "frame_size": FRAME_SIZE, "session": SESSION}
+    if COLORS:
+        hello["colors"] = list(COLORS)
+    if DETECTION_THRESHOLD:
+        hello["threshold"] = DETECTION_THRESHOLD
+    gate = ChangeGate() if CHANGE_GATE else None
+    sender = FrameSender(cam, frame_writer, hello, stats=stats, sent_times=sent_times,
+                         controller=bitrate, window=window, gate=gate)
     try:
-        while True:
-            frame = np.array(cam.get_frame())
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-            ok, jpeg = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), 80])
-            if not ok:
-                await asyncio.sleep(0.03)
-                continue
-
-            data = jpeg.tobytes()
-            frame_writer.write(struct.pack(">I", len(data)) + data)
-            await frame_writer.drain()
-
-            await asyncio.sleep(0.03)
+        await sender.run()
     except (ConnectionResetError, asyncio.IncompleteReadError):
         print("[FRAME CLIENT] Connection lost.")
     except Exception as e:
@@ -40,15 +69,24 @@ async def send_frames(frame_writer, keepalive=True):
 
 
 async def receive_detections(control_reader):
-    """Receive JSON detection messages from the server."""
+    """Receive detection messages (binary or JSON) from the server."""
     try:
         while True:
-            header = await control_reader.readexactly(4)
-            (msg_len,) = struct.unpack(">I", header)
-            payload = await control_reader.readexactly(msg_len)
-            data = json.loads(payload.decode())
+            data = await read_message(control_reader)
+            record_reply(stats, data, sent_times)
+            if data.get("seq") is not None:
+                window.ack(data["seq"])
+            if data.get("capture_time"):
+                bitrate.observe_rtt(time.monotonic() - data["capture_time"])
 
-            if data.get("objects"):
+            if data.get("tracks"):
+                print("Tracked objects from server:",
+                      {t["id"]: (t["color"], tuple(t["box"])) for t in data["tracks"]})
+            elif data.get("colors"):
+                found = {color: boxes for color, boxes in data["colors"].items() if boxes}
+                if found:
+                    print("Detections from server:", found)
+            elif data.get("objects"):
                 print("Detections from server:", data["objects"])
     except asyncio.IncompleteReadError:
         print("[CONTROL CLIENT] Server closed control connection.")
@@ -58,11 +96,17 @@ async def receive_detections(control_reader):
 
 async def start_client(ip, frame_port=FRAME_PORT, control_port=CONTROL_PORT):
     """Launch both channels for use by tools.py or directly."""
+    new_run()
+    # Open the camera and load OpenCV while the connections come up
+    cam.warm()
+    preload("numpy", "cv2")
     print("Connecting frame channel...")
     _, writer_f = await asyncio.open_connection(ip, frame_port)
     print("Connecting control channel...")
-    reader_c, _ = await asyncio.open_connection(ip, control_port)
-    print("Both channels connected. Streaming...")
+    reader_c, writer_c = await asyncio.open_connection(ip, control_port)
+    writer_c.write(encode_hello({"session": SESSION}))
+    await writer_c.drain()
+    print(f"Both channels connected (session {SESSION}). Streaming...")
 
     # Run both coroutines until one fails
     await asyncio.gather(
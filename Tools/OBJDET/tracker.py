@@ -0,0 +1,149 @@
+"""Object tracking for OBJDET, so most frames only search near known objects.
+
+Detections are associated to tracks by nearest predicted centroid (per
+color), giving each object an ID that stays stable across frames. Tracks
+move with a smoothed constant-velocity model; for the next frame the tracker
+hands out padded search windows around the predicted boxes instead of asking
+for a full-frame scan. A full scan still happens every RESCAN_INTERVAL
+frames (to pick up new objects), whenever nothing is being tracked, and as
+soon as a track is lost.
+
+Box coordinates are in full-frame pixels; frame numbers are the stream's
+seq numbers, so frames in flight are predicted the right distance ahead.
+"""
+import math
+
+# Frames between full-frame scans while tracking
+RESCAN_INTERVAL = 10
+# Extra pixels around a predicted box, on top of SEARCH_MARGIN of its size
+SEARCH_PADDING = 16
+SEARCH_MARGIN = 0.25
+# Weight of the newest measured motion in the velocity estimate
+VELOCITY_GAIN = 0.5
+# Frames a track may go unseen before it is dropped
+MAX_MISSED = 2
+
+
+class Track:
+    def __init__(self, track_id, color, box, seq):
+        self.id = track_id
+        self.color = color
+        self.box = box  # (x, y, w, h)
+        self.velocity = (0.0, 0.0)  # pixels per frame
+        self.seq = seq
+        self.missed = 0
+
+    def predict(self, seq):
+        """Box expected at frame seq."""
+        x, y, w, h = self.box
+        dt = seq - self.seq
+        return (x + self.velocity[0] * dt, y + self.velocity[1] * dt, w, h)
+
+    def update(self, box, seq):
+        dt = max(1, seq - self.seq)
+        (cx, cy), (nx, ny) = center(self.box), center(box)
+        vx = (nx - cx) / dt
+        vy = (ny - cy) / dt
+        self.velocity = (self.velocity[0] + VELOCITY_GAIN * (vx - self.velocity[0]),
+                         self.velocity[1] + VELOCITY_GAIN * (vy - self.velocity[1]))
+        self.box = box
+        self.seq = seq
+        self.missed = 0
+
+
+def center(box):
+    x, y, w, h = box
+    return x + w / 2, y + h / 2
+
+
+def merge_windows(windows):
+    """Merge overlapping (color, (x0, y0, x1, y1)) windows of the same color."""
+    merged = []
+    for color, rect in windows:
+        changed = True
+        while changed:
+            changed = False
+            for i, (other_color, other) in enumerate(merged):
+                if other_color == color and rect[0] < other[2] and other[0] < rect[2] \
+                        and rect[1] < other[3] and other[1] < rect[3]:
+                    rect = (min(rect[0], other[0]), min(rect[1], other[1]),
+                            max(rect[2], other[2]), max(rect[3], other[3]))
+                    del merged[i]
+                    changed = True
+                    break
+        merged.append((color, rect))
+    return merged
+
+
+class Tracker:
+    """Keeps object IDs across frames and decides where to search next."""
+
+    def __init__(self, rescan_interval=RESCAN_INTERVAL, padding=SEARCH_PADDING, max_missed=MAX_MISSED):
+        self.rescan_interval = rescan_interval
+        self.padding = padding
+        self.max_missed = max_missed
+        self.tracks = []
+        self.next_id = 1
+        self.last_scan = None
+        self.rescan = True
+
+    def plan(self, seq):
+        """Search windows for frame seq as [(color, (x0, y0, x1, y1))], or None for a full scan."""
+        if (self.rescan or not self.tracks or self.last_scan is None
+                or seq - self.last_scan >= self.rescan_interval):
+            self.rescan = False
+            self.last_scan = seq
+            return None
+        windows = []
+        for track in self.tracks:
+            x, y, w, h = track.predict(seq)
+            pad_x = self.padding + SEARCH_MARGIN * w + abs(track.velocity[0])
+            pad_y = self.padding + SEARCH_MARGIN * h + abs(track.velocity[1])
+            windows.append((track.color, (max(0, int(x - pad_x)), max(0, int(y - pad_y)),
+                                          int(math.ceil(x + w + pad_x)), int(math.ceil(y + h + pad_y)))))
+        return merge_windows(windows)
+
+    def update(self, seq, found, full):
+        """Feed the detections {color: [box, ...]} for frame seq.
+
+        full says whether the whole frame was searched. Returns the tracks
+        seen in this frame as [(id, color, (x, y, w, h))].
+        """
+        seen = []
+        matched = set()
+        for color, boxes in found.items():
+            tracks = [t for t in self.tracks if t.color == color]
+            pairs = []
+            for i, box in enumerate(boxes):
+                bx, by = center(box)
+                for track in tracks:
+                    predicted = track.predict(seq)
+                    px, py = center(predicted)
+                    distance = math.hypot(bx - px, by - py)
+                    # Accept a match within one object size plus the search padding
+                    if distance <= max(predicted[2], predicted[3]) + self.padding:
+                        pairs.append((distance, i, track))
+            used = set()
+            for _, i, track in sorted(pairs, key=lambda p: p[0]):
+                if i in used or track.id in matched:
+                    continue
+                used.add(i)
+                matched.add(track.id)
+                track.update(boxes[i], seq)
+                seen.append(track)
+            for i, box in enumerate(boxes):
+                if i not in used:
+                    track = Track(self.next_id, color, box, seq)
+                    self.next_id += 1
+                    self.tracks.append(track)
+                    matched.add(track.id)
+                    seen.append(track)
+
+        for track in self.tracks:
+            if track.id not in matched:
+                track.missed += 1
+                if not full:
+                    # Lost inside its window: look everywhere next frame
+                    self.rescan = True
+        self.tracks = [t for t in self.tracks if t.missed <= self.max_missed]
+        return [(t.id, t.color, tuple(int(round(v)) for v in t.box)) for t in seen]
@@ -0,0 +1,136 @@
+"""Drive, brake light and pan/tilt servos for the RC server.
+
+Input handlers call Actuator.input() as soon as a key event or snapshot
+arrives, and the drive command is applied right away. Hardware is only
+written when a value actually changes, so a repeated key or a snapshot
+with the same keys costs nothing. The servos move on their own SERVO_HZ
+timer: held arrow keys move the target at SERVO_SPEED, and the servos
+follow the target no faster than SERVO_SLEW. The same timer brakes the
+robot if it is moving and no input has arrived for DEADMAN_TIMEOUT seconds.
+"""
+import time
+
+from Tools.sender import Pacer
+from Tools.RC.snapshot import PAN_RANGE, TILT_RANGE
+
+DRIVE_SPEED = 1  # fraction of max speed for w/s
+ROTATE_SPEED = 0.2  # in-place rotation for a/d
+SERVO_HZ = 50
+SERVO_SPEED = 50  # degrees per second while an arrow key is held
+SERVO_SLEW = 180  # degrees per second, fastest a servo follows its target
+# Brake when moving and no input arrived for this long (seconds); None disables
+DEADMAN_TIMEOUT = 1.0
+
+
+def drive_command(keys):
+    """(DriveController method, argument) for the held keys, or None to stop."""
+    if "w" in keys:
+        return "forward", DRIVE_SPEED
+    if "s" in keys:
+        return "backward", DRIVE_SPEED
+    if "a" in keys:
+        return "rotate", ROTATE_SPEED
+    if "d" in keys:
+        return "rotate", -ROTATE_SPEED
+    return None
+
+
+def clamp(value, limits):
+    return max(limits[0], min(limits[1], value))
+
+
+class Actuator:
+    """Applies RC input to the robot's hardware, skipping unchanged writes."""
+
+    def __init__(self, drive, brakelight, panservo, tiltservo, hz=SERVO_HZ, deadman=DEADMAN_TIMEOUT):
+        self.drive = drive
+        self.brakelight = brakelight
+        self.servos = {"pan": panservo, "tilt": tiltservo}
+        self.hz = hz
+        self.deadman = deadman
+        self.keys = set()
+        self.command = ()  # last drive command written; () = nothing written yet
+        self.light = None
+        self.target = {"pan": 0.0, "tilt": 0.0}
+        self.angle = {"pan": None, "tilt": None}  # where the ramp is, None = not written yet
+        self.written = {"pan": None, "tilt": None}
+        self.last_input = time.monotonic()
+        self.running = False
+
+    def input(self, keys, pan=None, tilt=None):
+        """New input state: held keys, plus absolute servo targets from snapshots."""
+        self.last_input = time.monotonic()
+        self.keys = set(keys)
+        if pan is not None:
+            self.target["pan"] = clamp(pan, PAN_RANGE)
+        if tilt is not None:
+            self.target["tilt"] = clamp(tilt, TILT_RANGE)
+        self.apply_drive()
+
+    def apply_drive(self):
+        command = drive_command(self.keys)
+        if command == self.command:
+            return
+        self.command = command
+        if command is None:
+            self.drive.stop()
+        else:
+            method, value = command
+            getattr(self.drive, method)(value)
+        self.set_light(command is None)
+
+    def set_light(self, on):
+        if on == self.light:
+            return
+        self.light = on
+        if on:
+            self.brakelight.on()
+        else:
+            self.brakelight.off()
+
+    def brake(self):
+        self.keys = set()
+        self.apply_drive()
+
+    def step_servos(self, dt):
+        # Held arrow keys move the targets (TCP keybinds; snapshots send targets)
+        step = SERVO_SPEED * dt
+        if "left" in self.keys:
+            self.target["pan"] = clamp(self.target["pan"] + step, PAN_RANGE)
+        elif "right" in self.keys:
+            self.target["pan"] = clamp(self.target["pan"] - step, PAN_RANGE)
+        if "down" in self.keys:
+            self.target["tilt"] = clamp(self.target["tilt"] + step, TILT_RANGE)
+        elif "up" in self.keys:
+            self.target["tilt"] = clamp(self.target["tilt"] - step, TILT_RANGE)
+
+        slew = SERVO_SLEW * dt
+        for name, servo in self.servos.items():
+            angle, target = self.angle[name], self.target[name]
+            angle = target if angle is None else angle + max(-slew, min(slew, target - angle))
+            self.angle[name] = angle
+            if round(angle) != self.written[name]:
+                self.written[name] = round(angle)
+                servo.target_angle = self.written[name]
+
+    async def run(self):
+        """Servo ramp and deadman timer; runs until stop() is called."""
+        self.running = True
+        pacer = Pacer(self.hz)
+        last = time.monotonic()
+        self.apply_drive()
+        try:
+            while self.running:
+                await pacer.wait_async()
+                now = time.monotonic()
+                dt, last = now - last, now
+                if (self.deadman is not None and self.command is not None
+                        and now - self.last_input > self.deadman):
+                    print(f"[RC] No input for {self.deadman:.1f} s, braking")
+                    self.brake()
+                self.step_servos(dt)
+        finally:
+            self.drive.stop()
+
+    def stop(self):
+        self.running = False
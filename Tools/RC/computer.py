@@ -8,20 +8,37 @@ Purposes for Libraries Used:
 - cv2 (OpenCV): For decoding and displaying video frames.
 - numpy: For efficient array manipulations, especially for image data.
 - pynput: For capturing keyboard events and sending them to the Pi-top.
-- threading: For running the video receiver in a separate thread.
+- threading: For running the video receiver and the snapshot sender in separate threads.
+- time: Paces the UDP input snapshots.
 
 !!NOTE!!: This code is intended to be run on a client computer, not on the Pi-top itself.
 It requires the Pi-top server code to be running and accessible on the specified network.
 """
-import socket, struct, cv2, numpy as np
+import socket, struct, cv2, numpy as np, time
 from pynput import keyboard
 import threading
+from Tools.RC.snapshot import encode_snapshot, SNAPSHOT_PORT, SNAPSHOT_HZ, PAN_RANGE, TILT_RANGE
 KEYBIND_PORT = 9999
 VIDEO_PORT = 10000
+# "udp": send the full input state SNAPSHOT_HZ times a second (see snapshot.py)
+# "tcp": send a PRESS_/RELEASE_ line per key event to the keybind server
+CONTROL_MODE = "udp"
+# Pan/tilt servo speed while an arrow key is held, degrees per second
+SERVO_SPEED = 50
+# Video messages: >BI type, size header, then the payload. The receive buffer
+# starts at VIDEO_BUFFER bytes (about one 1280x720 JPEG) and grows as needed
+VIDEO_HEADER = struct.Struct(">BI")
+VIDEO_BUFFER = 256 * 1024
+# Snapshots still sent after escape, so the exit survives packet loss
+EXIT_SNAPSHOTS = 5
 
 # module-level sockets so callbacks can access them
 keybind_sock = None
 video_sock = None
+snapshot_sock = None
+
+# Keys currently held ("w", "left", "escape", ...), read by the snapshot thread
+held = set()
 
 def send_cmd(msg: str):
     """Send a newline-terminated command to the keybind server (safe no-op if socket missing)."""
@@ -31,8 +48,20 @@ def send_cmd(msg: str):
     except Exception:
         pass
 
+def key_name(key):
+    if hasattr(key, "char") and key.char:
+        return key.char.lower()
+    names = {keyboard.Key.left: "left", keyboard.Key.right: "right", keyboard.Key.up: "up",
+             keyboard.Key.down: "down", keyboard.Key.esc: "escape"}
+    return names.get(key)
+
 def on_press(key):
     try:
+        if CONTROL_MODE == "udp":
+            name = key_name(key)
+            if name and name != "escape":
+                held.add(name)
+            return
         if hasattr(key, "char") and key.char:
             send_cmd(f"PRESS_{key.char.upper()}")
         elif key == keyboard.Key.left:
@@ -48,6 +77,18 @@ def on_press(key):
 
 def on_release(key):
     try:
+        if CONTROL_MODE == "udp":
+            name = key_name(key)
+            if name == "escape":
+                held.add("escape")  # the snapshot thread sends it and stops
+                try:
+                    if video_sock:
+                        video_sock.close()
+                except Exception:
+                    pass
+                return False
+            held.discard(name)
+            return
         if hasattr(key, "char") and key.char:
             send_cmd(f"RELEASE_{key.char.upper()}")
         elif key == keyboard.Key.left:
@@ -75,23 +116,63 @@ def on_release(key):
     except Exception:
         pass
 
+# Thread for sending input snapshots over UDP
+def snapshot_thread(ip):
+    pan, tilt = 0, 0
+    seq = 0
+    exiting = 0
+    period = 1 / SNAPSHOT_HZ
+    step = SERVO_SPEED * period
+    next_send = time.monotonic()
+    while exiting < EXIT_SNAPSHOTS:
+        keys = set(held)
+        # Same directions as the Pi's arrow handling
+        if "left" in keys:
+            pan = min(PAN_RANGE[1], pan + step)
+        elif "right" in keys:
+            pan = max(PAN_RANGE[0], pan - step)
+        if "down" in keys:
+            tilt = min(TILT_RANGE[1], tilt + step)
+        elif "up" in keys:
+            tilt = max(TILT_RANGE[0], tilt - step)
+        if "escape" in keys:
+            exiting += 1
+        try:
+            snapshot_sock.sendto(encode_snapshot(seq, keys, round(pan), round(tilt)), (ip, SNAPSHOT_PORT))
+        except OSError:
+            pass  # no route for a moment: the next snapshot carries the same state
+        seq += 1
+        next_send = max(next_send + period, time.monotonic())
+        time.sleep(max(0.0, next_send - time.monotonic()))
+    snapshot_sock.close()
+
+def recv_exact(sock, view):
+    """Fill a memoryview from the socket. Returns False if the connection closed first."""
+    while len(view):
+        n = sock.recv_into(view)
+        if not n:
+            return False
+        view = view[n:]
+    return True
+
 # Thread for receiving video frames
 def video_thread():
     global video_sock
+    header = bytearray(VIDEO_HEADER.size)
+    # Reused for every frame, grown only when a bigger frame arrives
+    buffer = bytearray(VIDEO_BUFFER)
     try:
         while True:
-            header = video_sock.recv(5)
-            if not header:
+            if not recv_exact(video_sock, memoryview(header)):
+                break
+            msg_type, size = VIDEO_HEADER.unpack(header)
+            if size > len(buffer):
+                buffer = bytearray(size * 2)
+            if not recv_exact(video_sock, memoryview(buffer)[:size]):
                 break
-            msg_type, size = struct.unpack(">BI", header)
-            data = b""
-            while len(data) < size:
-                packet = video_sock.recv(size - len(data))
-                if not packet:
-                    break
-                data += packet
             if msg_type == 0x01:  # JPEG frame
-                frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                # Decode straight out of the receive buffer (no copy)
+                frame = cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8, count=size), cv2.IMREAD_COLOR)
                 if frame is not None:
                     cv2.imshow("Pi-top Camera", frame)
                     if cv2.waitKey(1) & 0xFF == 27:
@@ -107,19 +188,26 @@ def video_thread():
         cv2.destroyAllWindows()
 
 def main(ip: str):
-    global keybind_sock, video_sock
-    try:
-        keybind_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        keybind_sock.connect((ip, KEYBIND_PORT))
-        print(f"Connected to keybind server {ip} at port {KEYBIND_PORT}")
-    except Exception:
-        print(f"Connection to keybind server timed out or failed!")
+    global keybind_sock, video_sock, snapshot_sock
+    snapshot_t = None
+    if CONTROL_MODE == "udp":
+        snapshot_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        snapshot_t = threading.Thread(target=snapshot_thread, args=(ip,), daemon=True)
+        snapshot_t.start()
+        print(f"Sending input snapshots to {ip} at UDP port {SNAPSHOT_PORT}")
+    else:
+        try:
+            keybind_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            keybind_sock.connect((ip, KEYBIND_PORT))
+            print(f"Connected to keybind server {ip} at port {KEYBIND_PORT}")
+        except Exception:
+            print(f"Connection to keybind server timed out or failed!")
 
     # Video socket (Receives Video Frames)
     try:
         video_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        video_sock.connect((HOST, VIDEO_PORT))
-        print(f"Connected to video server {HOST} at port {VIDEO_PORT}")
+        video_sock.connect((ip, VIDEO_PORT))
+        print(f"Connected to video server {ip} at port {VIDEO_PORT}")
     except Exception:
         print(f"Connection to video server timed out or failed!")
 
@@ -134,6 +222,8 @@ def main(ip: str):
     except KeyboardInterrupt:
         pass
     finally:
+        if snapshot_t is not None and "escape" in held:
+            snapshot_t.join(1)  # let the exit snapshots go out
         try:
             if keybind_sock:
                 keybind_sock.close()
@@ -8,30 +8,52 @@ Purposes for Libraries Used:
 - cv2 (OpenCV): For image processing and encoding frames to JPEG.
 - numpy: For efficient array manipulations, especially for image data.
 - struct: For packing and unpacking binary data for network transmission.
-- sys: Seamlessly exits the program when escape is pressed.
+- time: Measures how long socket drains stall, for adaptive bitrate.
+- Tools.broadcast: Runs the camera capture and JPEG encoding once, in a worker thread, for every connected viewer.
 - pitop: To interface with Pi-top hardware components like Camera, ServoMotor, LED, and DriveController.
+- Tools.broker: Reads the camera and ultrasonic sensor from the shared hardware broker when it is running.
+- Tools.startup: Defers loading OpenCV, numpy and pitop and opening each device until first use, for a fast launch.
 - pitop.robotics: Specifically for controlling the robot's drive system.
 
 !!NOTE!!: This code is to ONLY be ran on the pi-top itself, and does not have any functionality on a normal computer.
 This code also cannot be ran standalone, as it needs a client running the controller.py in the same directory to have proper functionality.
 """
-import asyncio as aio, cv2, numpy as np, struct, sys
-from pitop import Camera, ServoMotor, LED, UltrasonicSensor
-from pitop.robotics import DriveController
-
-
-cam = Camera(resolution=(1280, 720))
-uss = UltrasonicSensor("D3", threshold_distance=1, max_distance=300)
-brakelight = LED("D0")
-panservo = ServoMotor("S0")
-tiltservo = ServoMotor("S1")
-drive = DriveController(left_motor_port="M1", right_motor_port="M0")
-
-state = {"keys": set(), "running": True, "pan_angle": 0, "tilt_angle": 0}
+import asyncio as aio, struct, time
+from Tools.startup import LazyDevice, lazy_import, mark, preload
+from Tools.broker import open_camera, open_ultrasonic
+from Tools.bitrate import BitrateController
+from Tools.sender import ChangeGate
+from Tools.broadcast import Broadcaster
+from Tools.RC.snapshot import SnapshotReceiver, SNAPSHOT_PORT
+from Tools.RC.actuator import Actuator
+
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+pitop = lazy_import("pitop")
+robotics = lazy_import("pitop.robotics")
+
+# Camera and ultrasonic sensor are shared through the hardware broker when it runs.
+# Every device is opened on first use, so the servers are up before the hardware is
+cam = LazyDevice(lambda: open_camera((1280, 720)), "camera")
+uss = LazyDevice(lambda: open_ultrasonic("D3", threshold_distance=1, max_distance=300), "ultrasonic")
+brakelight = LazyDevice(lambda: pitop.LED("D0"), "brake light")
+panservo = LazyDevice(lambda: pitop.ServoMotor("S0"), "pan servo")
+tiltservo = LazyDevice(lambda: pitop.ServoMotor("S1"), "tilt servo")
+drive = LazyDevice(lambda: robotics.DriveController(left_motor_port="M1", right_motor_port="M0"), "drive")
+
+# Skip encoding/sending frames that barely changed (a keyframe still goes out
+# at least once a second)
+CHANGE_GATE = True
+# Also accept input snapshots over UDP (see snapshot.py) next to the TCP keybind server
+UDP_CONTROL = True
+
+# Reset by main(), which the agent can run again in the same process
+state = {"keys": set(), "running": True, "stop": None, "writers": set(), "overlay": None}
 
 
 # Keybind server: receives keybinds from controller
 async def handle_keybinds(reader, writer):
+    state["writers"].add(writer)
     while state["running"]:
         line = await reader.readline()
         if not line:
@@ -42,13 +64,13 @@ async def handle_keybinds(reader, writer):
         if msg.startswith("PRESS_"):
             key = msg[6:].lower()
             state["keys"].add(key)
+            actuator.input(state["keys"])
         elif msg.startswith("RELEASE_"):
             key = msg[8:].lower()
             state["keys"].discard(key)
+            actuator.input(state["keys"])
         elif msg == "EXIT":
-            state["running"] = False
-            loop = aio.get_event_loop()
-            loop.call_later(10, sys.exit, 0) 
+            shutdown(10)
 
         # Send back confirmation
         response = f"OK {msg}".encode()
@@ -56,81 +78,119 @@ async def handle_keybinds(reader, writer):
         writer.write(header + response)
         await writer.drain()
 
+    state["writers"].discard(writer)
     writer.close()
 
+# Snapshot receiver: the controller's full input state over UDP
+def apply_snapshot(keys, pan, tilt):
+    state["keys"] = keys
+    actuator.input(keys, pan, tilt)
+    if "escape" in keys and state["running"]:
+        shutdown(1)
+
+# Video producer: one capture/encode loop in its own thread, shared by every viewer
+def produce_frame():
+    frame = np.array(cam.get_frame())  # PIL image
+    overlay = f"Ultrasonic Sensor Distance: {uss.distance:.2f} m"
+    # A still scene is skipped, unless the distance shown on it has changed
+    changed = gate is None or gate.changed(frame)
+    if not changed and overlay == state["overlay"]:
+        return None
+    state["overlay"] = overlay
+    frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+    cv2.putText(frame, overlay, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+    if bitrate.scale < 1.0:
+        frame = cv2.resize(frame, None, fx=bitrate.scale, fy=bitrate.scale, interpolation=cv2.INTER_AREA)
+    _, jpeg = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), bitrate.quality])
+    data = jpeg.tobytes()
+    return struct.pack(">BI", 0x01, len(data)) + data  # type=1, size
+
+# Fresh video state for each run of main() (the agent reuses this module)
+def new_run():
+    global bitrate, gate, video
+    # Quality, resolution and frame rate back off when a viewer's link can't keep up
+    bitrate = BitrateController(quality_range=(30, 80), name="RC")
+    gate = ChangeGate() if CHANGE_GATE else None
+    video = Broadcaster(produce_frame, controller=bitrate, name="RC VIDEO")
+
+new_run()
+
 # Video server: sends video frames to controller
 async def handle_video(reader, writer):
-    while state["running"]:
-        frame = cam.get_frame()  # PIL image
-        frame = cv2.cvtColor(np.array(frame), cv2.COLOR_RGB2BGR)
-        cv2.putText(frame, f"Ultrasonic Sensor Distance: {uss.distance} m", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-        _, jpeg = cv2.imencode(".jpg", frame)
-        data = jpeg.tobytes()
-        header = struct.pack(">BI", 0x01, len(data))  # type=1, size
-        writer.write(header + data)
-        await writer.drain()
-        await aio.sleep(0.033)  # ~30 FPS
-    writer.close()
-
-#region Variable Setting
-async def variable_setter():
-    while state["running"]:
-        if "w" in state["keys"]:
-            drive.forward(1)  # 100% of max speed
-            if brakelight.is_lit:
-                brakelight.off()
-        elif "s" in state["keys"]:
-            drive.backward(1)
-            if brakelight.is_lit:
-                brakelight.off()
-        elif "a" in state["keys"]:
-            drive.rotate(0.2)  # rotate left in place
-            if brakelight.is_lit:
-                brakelight.off()
-        elif "d" in state["keys"]:
-            drive.rotate(-0.2)  # rotate right in place
-            if not brakelight.is_lit:
-                brakelight.off()
-        else:
-            drive.stop()
-            if not brakelight.is_lit:
-                brakelight.on()
-
-
-        # Servo control
-        if 'left' in state["keys"]:
-            state["pan_angle"] = min(90, state["pan_angle"] + 5)
-        elif 'right' in state["keys"]:
-            state["pan_angle"] = max(-90, state["pan_angle"] - 5)
-        panservo.target_angle = state['pan_angle']
-
-        if 'down' in state["keys"]:
-            state["tilt_angle"] = min(80, state["tilt_angle"] + 5)
-        elif 'up' in state["keys"]:
-            state["tilt_angle"] = max(-80, state["tilt_angle"] - 5)
-        tiltservo.target_angle = state['tilt_angle']
-
-        # Exit program
-        if 'escape' in state["keys"]:
-            state["running"] = False
-            loop = aio.get_event_loop()
-            loop.call_later(1, sys.exit, 0)
-
-        await aio.sleep(0.1)  # keep looping
-
+    # Each viewer only gets the newest frame; a slow one skips frames
+    frames = video.subscribe()
+    state["writers"].add(writer)
+    try:
+        while state["running"]:
+            message = await frames.get()
+            if message is None:
+                break
+            start = time.monotonic()
+            writer.write(message)
+            await writer.drain()
+            bitrate.observe_drain(time.monotonic() - start)
+            mark("first frame sent")
+    except (ConnectionResetError, BrokenPipeError):
+        pass
+    finally:
+        video.unsubscribe(frames)
+        state["writers"].discard(writer)
+        writer.close()
+
+#region Actuation
+# Drive and servo writes happen as soon as input arrives, and only when a value
+# changes; the servo ramp and the deadman brake run on the actuator's own timer
+actuator = Actuator(drive, brakelight, panservo, tiltservo)
+
+def shutdown(delay):
+    state["running"] = False
+    actuator.brake()
+    actuator.stop()
+    # Ends main() only: under the agent the other tools keep running
+    aio.get_running_loop().call_later(delay, state["stop"].set)
 
 #endregion
 
 #region Main
 
 async def main():
+    state.update(keys=set(), running=True, stop=aio.Event(), writers=set(), overlay=None)
+    new_run()
+    # Get the camera and OpenCV ready while waiting for the controller
+    cam.warm()
+    uss.warm()
+    preload("numpy", "cv2")
     keybind_server = await aio.start_server(handle_keybinds, "0.0.0.0", 9999)
     video_server = await aio.start_server(handle_video, "0.0.0.0", 10000)
     print("Keybind server running on 9999")
     print("Video server running on 10000")
-    async with keybind_server, video_server:
-        await aio.gather(
-            variable_setter(),
-            keybind_server.serve_forever(),
-            video_server.serve_forever(),
-        )
\ No newline at end of file
+    transport = None
+    try:
+        if UDP_CONTROL:
+            transport, _ = await aio.get_running_loop().create_datagram_endpoint(
+                lambda: SnapshotReceiver(apply_snapshot), local_addr=("0.0.0.0", SNAPSHOT_PORT))
+            print(f"Snapshot control running on UDP {SNAPSHOT_PORT}")
+        async with keybind_server, video_server:
+            tasks = [aio.create_task(work) for work in (
+                actuator.run(),
+                keybind_server.serve_forever(),
+                video_server.serve_forever(),
+                state["stop"].wait(),
+            )]
+            try:
+                done, _ = await aio.wait(tasks, return_when=aio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()  # raise if a server failed
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await aio.gather(*tasks, return_exceptions=True)
+    finally:
+        # Free the ports and the video thread for the next run
+        state["running"] = False
+        actuator.stop()
+        video.stop()
+        for writer in list(state["writers"]):
+            writer.close()
+        if transport is not None:
+            transport.close()
\ No newline at end of file
@@ -0,0 +1,76 @@
+"""UDP input snapshots for remote control.
+
+Instead of one TCP line per key press/release (each acknowledged by the
+Pi), the controller sends its whole input state SNAPSHOT_HZ times a second
+as one small datagram: a sequence number, a bitmask of the held KEYS and
+the pan/tilt servo targets in degrees. Nothing is acknowledged. A lost
+datagram is replaced by the next one, and anything older than the newest
+snapshot already applied is ignored, so no packet can hold up the ones
+behind it. If snapshots stop altogether, the Pi's actuator deadman brakes
+(see actuator.py).
+"""
+import asyncio
+import struct
+import time
+
+SNAPSHOT_PORT = 9998
+SNAPSHOT_HZ = 30
+SNAPSHOT_MAGIC = b"RC"
+SNAPSHOT = struct.Struct(">2sIHbb")  # magic, seq, held key bitmask, pan, tilt target (degrees)
+
+# Bit order of the key bitmask
+KEYS = ("w", "a", "s", "d", "escape")
+PAN_RANGE = (-90, 90)
+TILT_RANGE = (-80, 80)
+
+
+def encode_snapshot(seq, keys, pan, tilt):
+    mask = 0
+    for bit, key in enumerate(KEYS):
+        if key in keys:
+            mask |= 1 << bit
+    return SNAPSHOT.pack(SNAPSHOT_MAGIC, seq & 0xFFFFFFFF, mask, int(pan), int(tilt))
+
+
+def decode_snapshot(data):
+    """(seq, keys, pan, tilt) from a datagram, or None if it isn't a snapshot."""
+    if len(data) != SNAPSHOT.size:
+        return None
+    magic, seq, mask, pan, tilt = SNAPSHOT.unpack(data)
+    if magic != SNAPSHOT_MAGIC:
+        return None
+    keys = {key for bit, key in enumerate(KEYS) if mask & (1 << bit)}
+    return seq, keys, pan, tilt
+
+
+class SnapshotReceiver(asyncio.DatagramProtocol):
+    """Applies the newest snapshot from the controller and drops older ones.
+
+    on_snapshot(keys, pan, tilt) is called for every snapshot newer than the
+    last one applied. A new controller address starts a fresh sequence.
+    """
+
+    def __init__(self, on_snapshot):
+        self.on_snapshot = on_snapshot
+        self.addr = None
+        self.last_seq = None
+        self.updated = 0.0  # monotonic time of the last applied snapshot
+        self.applied = 0
+        self.stale = 0
+
+    def datagram_received(self, data, addr):
+        snapshot = decode_snapshot(data)
+        if snapshot is None:
+            return
+        seq, keys, pan, tilt = snapshot
+        if addr != self.addr:
+            print(f"[RC UDP] Controller at {addr[0]}:{addr[1]}")
+            self.addr = addr
+            self.last_seq = None
+        if self.last_seq is not None and seq <= self.last_seq:
+            self.stale += 1
+            return
+        self.last_seq = seq
+        self.updated = time.monotonic()
+        self.applied += 1
+        self.on_snapshot(keys, pan, tilt)
@@ -1,37 +1,57 @@
-from pitop import UltrasonicSensor, Pitop, ServoMotor, Buzzer, LED
 import asyncio as aio
-from pitop.robotics import DriveController
 import time
+from Tools.USM.sampler import UltrasonicSampler
+from Tools.broker import open_ultrasonic
+from Tools.startup import LazyDevice, lazy_import
 
-ultrasonic = UltrasonicSensor("D2", threshold_distance=1)
-drive = DriveController("M1", "M0")
-panservo = ServoMotor("S0")
-buzzer = Buzzer("D1")
-led = LED("D0")
-panservo.target_angle = 0
-miniscreen = Pitop().miniscreen
+pitop = lazy_import("pitop")
+robotics = lazy_import("pitop.robotics")
+
+# Stop when the filtered distance is under STOP_DISTANCE (m), or will be
+# within REACTION_TIME (s) at the current closing speed
+STOP_DISTANCE = 0.5
+REACTION_TIME = 0.3
+
+# Devices are opened on first use (see Tools/startup.py)
+ultrasonic = LazyDevice(lambda: open_ultrasonic("D2", threshold_distance=1), "ultrasonic")
+drive = LazyDevice(lambda: robotics.DriveController("M1", "M0"), "drive")
+panservo = LazyDevice(lambda: pitop.ServoMotor("S0"), "pan servo")
+buzzer = LazyDevice(lambda: pitop.Buzzer("D1"), "buzzer")
+led = LazyDevice(lambda: pitop.LED("D0"), "LED")
+miniscreen = LazyDevice(lambda: pitop.Pitop().miniscreen, "miniscreen")
+
+def blocked(reading):
+    ahead = reading.smoothed - max(0.0, reading.closing_speed) * REACTION_TIME
+    return reading.distance < STOP_DISTANCE or ahead < STOP_DISTANCE
 
 async def main():
+    panservo.target_angle = 0
+    # Reads the sensor at a fixed rate in its own thread (see sampler.py), which
+    # also opens it there, off the event loop
+    sampler = UltrasonicSampler(ultrasonic)
     msgchin = False
     msgchout = False
-    while True:
-        if ultrasonic.distance < 0.5:
-            msgchout = False
-            info = "Obstacle Detected! Stopping."
-            if not msgchin:
-                led.on()
-                buzzer.beep(0.1, 0.1, 3)
-                print(info)
-                miniscreen.display_multiline_text(info, font_size=14)
-                msgchin = True
-            drive.stop()
-            drive.rotate(angle=90)
-        else:
-            msgchin = False
-            info = "Path Clear. Moving Forward."
-            if not msgchout:
-                led.off()
-                print(info)
-                miniscreen.display_multiline_text(info, font_size=14)
-                msgchout = True
-            drive.forward(50)
\ No newline at end of file
+    try:
+        async for reading in sampler.readings():
+            if blocked(reading):
+                msgchout = False
+                info = "Obstacle Detected! Stopping."
+                if not msgchin:
+                    led.on()
+                    buzzer.beep(0.1, 0.1, 3)
+                    print(f"{info} ({reading.distance:.2f} m, closing at {reading.closing_speed:.2f} m/s)")
+                    miniscreen.display_multiline_text(info, font_size=14)
+                    msgchin = True
+                drive.stop()
+                drive.rotate(angle=90)
+            else:
+                msgchin = False
+                info = "Path Clear. Moving Forward."
+                if not msgchout:
+                    led.off()
+                    print(info)
+                    miniscreen.display_multiline_text(info, font_size=14)
+                    msgchout = True
+                drive.forward(50)
+    finally:
+        sampler.stop()
@@ -0,0 +1,81 @@
+"""Fixed-rate ultrasonic sampling with filtering.
+
+The sensor is read SAMPLE_HZ times a second in a worker thread (a
+Tools.broadcast.Broadcaster), so the blocking GPIO reads never run on the
+event loop. The last RING_SIZE readings sit in a NumPy ring buffer, and
+each new reading yields a Reading with:
+  - distance: median of the ring, so one bad echo can't trigger a stop
+  - smoothed: exponential moving average of that median (EMA_ALPHA)
+  - closing_speed: how fast the obstacle approaches in m/s (positive =
+    getting closer), smoothed the same way
+"""
+import time
+from collections import namedtuple
+
+from Tools.broadcast import Broadcaster
+from Tools.startup import lazy_import
+
+np = lazy_import("numpy")
+
+SAMPLE_HZ = 20
+RING_SIZE = 5
+EMA_ALPHA = 0.3
+
+Reading = namedtuple("Reading", "distance smoothed closing_speed time")
+
+
+class DistanceFilter:
+    """Ring buffer of raw distances with median, EMA and closing speed."""
+
+    def __init__(self, size=RING_SIZE, alpha=EMA_ALPHA):
+        self.ring = np.full(size, np.nan)
+        self.index = 0
+        self.alpha = alpha
+        self.smoothed = None
+        self.closing_speed = 0.0
+        self.last_time = None
+
+    def add(self, distance, now):
+        self.ring[self.index] = distance
+        self.index = (self.index + 1) % len(self.ring)
+        median = float(np.nanmedian(self.ring))
+        if self.smoothed is None:
+            self.smoothed = median
+        else:
+            previous = self.smoothed
+            self.smoothed += self.alpha * (median - self.smoothed)
+            dt = now - self.last_time
+            if dt > 0:
+                speed = (previous - self.smoothed) / dt
+                self.closing_speed += self.alpha * (speed - self.closing_speed)
+        self.last_time = now
+        return Reading(median, self.smoothed, self.closing_speed, now)
+
+
+class UltrasonicSampler:
+    """Reads an UltrasonicSensor at a fixed rate and hands out filtered Readings."""
+
+    def __init__(self, sensor, hz=SAMPLE_HZ, size=RING_SIZE, alpha=EMA_ALPHA, name="USM"):
+        self.sensor = sensor
+        self.filter = DistanceFilter(size, alpha)
+        self.broadcaster = Broadcaster(self.sample, fps=hz, name=name)
+
+    def sample(self):
+        """Runs in the sampling thread."""
+        distance = self.sensor.distance
+        return self.filter.add(distance, time.monotonic())
+
+    async def readings(self):
+        """Yield the newest Reading as it comes in; readings the caller had no time for are skipped."""
+        queue = self.broadcaster.subscribe()
+        try:
+            while True:
+                reading = await queue.get()
+                if reading is None:
+                    return
+                yield reading
+        finally:
+            self.broadcaster.unsubscribe(queue)
+
+    def stop(self):
+        self.broadcaster.stop()
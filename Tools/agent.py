@@ -0,0 +1,272 @@
+"""Long-lived agent on the Pi that runs the tools without a fresh SSH launch each time.
+
+`python -m Tools.agent` imports Tools.tools and the Pi-side tool modules
+once, preloads OpenCV/numpy/pitop, then serves newline-delimited JSON
+requests on 127.0.0.1:AGENT_PORT. main.py reaches it through an SSH
+tunnel; anything on the Pi (or a test) can talk to it directly:
+
+  {"cmd": "status"}                                   running tools, repo revision
+  {"cmd": "start", "function": "run_color_isos", "args": ["10.0.0.2"]}
+  {"cmd": "stop", "function": "run_color_isos"}
+  {"cmd": "logs", "since": 0}                         output lines after index "since"
+  {"cmd": "sync", "revision": "<git sha>"}            git pull if the revision differs, then
+                                                      restart the agent if the pull changed it
+
+Every reply is one JSON line with "ok" (and "error" when it is false).
+Tools keep their devices between runs, since they live as long as the agent,
+but start each run with fresh connection state (their new_run()).
+
+`python -m Tools.agent status|stop <function>|start <function> [args...]`
+sends a single request to a local agent.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import deque
+
+from Tools.startup import preload, restart
+
+AGENT_PORT = 11100
+# Tool functions from Tools.tools the agent will run
+AGENT_FUNCTIONS = ("run_color_isos", "run_line_follows", "run_remote_control_server", "run_ultrasonic")
+# Imported when the agent starts so the first launch is already warm
+WARM_MODULES = ("Tools.OBJDET.pt", "Tools.LNFOL.pt", "Tools.RC.pt", "Tools.USM.pt")
+LOG_LINES = 1000
+STOP_TIMEOUT = 5.0
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class LogTee:
+    """Copies everything printed into a numbered ring of lines for the "logs" request."""
+
+    def __init__(self, stream, size=LOG_LINES):
+        self.stream = stream
+        self.lines = deque(maxlen=size)
+        self.count = 0  # lines ever written; the newest is count - 1
+        self.partial = ""
+
+    def write(self, text):
+        self.stream.write(text)
+        self.partial += text
+        *lines, self.partial = self.partial.split("\n")
+        for line in lines:
+            self.lines.append(line)
+            self.count += 1
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def since(self, index):
+        """(next index, lines from index on that are still kept)."""
+        first = self.count - len(self.lines)
+        return self.count, list(self.lines)[max(0, index - first):]
+
+
+def git_revision(repo=REPO_DIR):
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Agent:
+    """Runs Tools.tools functions as tasks on one event loop and answers requests about them."""
+
+    def __init__(self, log=None, functions=AGENT_FUNCTIONS, port=AGENT_PORT):
+        self.log = log
+        self.port = port
+        self.functions = functions
+        self.tasks = {}  # function name -> (task, args, start time)
+        self.results = {}  # function name -> how its last run ended
+        self.revision = git_revision()
+        self.restart = False
+
+    def warm(self):
+        preload("numpy", "cv2", "pitop")
+        for name in WARM_MODULES:
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                print(f"[AGENT] Could not preload {name}: {e}")
+
+    def status(self):
+        now = time.monotonic()
+        running = {name: {"args": args, "uptime": round(now - started, 1)}
+                   for name, (task, args, started) in self.tasks.items()}
+        return {"ok": True, "revision": self.revision, "running": running, "finished": self.results}
+
+    def start(self, function, args=()):
+        if function not in self.functions:
+            return {"ok": False, "error": f"unknown function {function!r}"}
+        if function in self.tasks:
+            return {"ok": False, "error": f"{function} is already running"}
+        tools = importlib.import_module("Tools.tools")
+        # Startup profiling counts from this run, not from when the agent started
+        restart()
+        task = asyncio.create_task(getattr(tools, function)(*args))
+        self.tasks[function] = (task, list(args), time.monotonic())
+        self.results.pop(function, None)
+        task.add_done_callback(lambda done: self.finished(function, done))
+        print(f"[AGENT] Started {function}{tuple(args)}")
+        return {"ok": True}
+
+    def finished(self, function, task):
+        self.tasks.pop(function, None)
+        if task.cancelled():
+            self.results[function] = "stopped"
+        elif task.exception() is not None:
+            self.results[function] = f"error: {task.exception()!r}"
+        else:
+            self.results[function] = "done"
+        print(f"[AGENT] {function} {self.results[function]}")
+
+    async def stop(self, function):
+        if function not in self.tasks:
+            return {"ok": False, "error": f"{function} is not running"}
+        task = self.tasks[function][0]
+        task.cancel()
+        await asyncio.wait([task], timeout=STOP_TIMEOUT)
+        return {"ok": True, "stopped": task.done()}
+
+    async def sync(self, revision):
+        """Pull the repo if it is not at revision; the agent restarts only if the pull changed it."""
+        if revision and revision == self.revision:
+            return {"ok": True, "synced": False, "revision": self.revision}
+        print(f"[AGENT] Syncing {self.revision} -> {revision}")
+        before = git_revision()
+        result = await asyncio.to_thread(
+            subprocess.run, "git stash && git pull", shell=True, cwd=REPO_DIR,
+            capture_output=True, text=True)
+        if result.returncode != 0:
+            return {"ok": False, "error": result.stderr.strip() or result.stdout.strip()}
+        self.revision = git_revision()
+        if self.revision == before:
+            # Nothing new upstream: revision is unpushed or on another branch
+            print(f"[AGENT] Already up to date at {self.revision}")
+            return {"ok": True, "synced": False, "revision": self.revision}
+        for function in list(self.tasks):
+            await self.stop(function)
+        self.restart = True
+        return {"ok": True, "synced": True, "revision": self.revision}
+
+    def logs(self, since=0):
+        if self.log is None:
+            return {"ok": True, "next": since, "lines": []}
+        index, lines = self.log.since(since)
+        return {"ok": True, "next": index, "lines": lines}
+
+    async def handle(self, request):
+        cmd = request.get("cmd")
+        if cmd == "status":
+            return self.status()
+        if cmd == "start":
+            return self.start(request.get("function"), request.get("args") or ())
+        if cmd == "stop":
+            return await self.stop(request.get("function"))
+        if cmd == "logs":
+            return self.logs(request.get("since", 0))
+        if cmd == "sync":
+            return await self.sync(request.get("revision"))
+        return {"ok": False, "error": f"unknown command {cmd!r}"}
+
+    async def serve_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    reply = await self.handle(json.loads(line))
+                except Exception as e:
+                    reply = {"ok": False, "error": repr(e)}
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+                if self.restart:
+                    asyncio.get_running_loop().call_later(0.2, self.reexec)
+        except ConnectionResetError:
+            pass
+        finally:
+            writer.close()
+
+    def reexec(self):
+        """Replace this process with a fresh agent running the synced code."""
+        print("[AGENT] Restarting on the new revision")
+        sys.stdout.flush()
+        os.execv(sys.executable, [sys.executable, "-u", "-m", "Tools.agent", "serve", "--port", str(self.port)])
+
+    async def serve(self, host="127.0.0.1"):
+        server = await asyncio.start_server(self.serve_client, host, self.port)
+        print(f"[AGENT] Listening on {host}:{self.port} (revision {self.revision})")
+        self.warm()
+        async with server:
+            await server.serve_forever()
+
+
+class AgentClient:
+    """Client for a socket-like connection to an agent (socket, paramiko Channel).
+
+    call() blocks; give the connection a timeout so a dead agent can't hang it.
+    call_async() runs call() in a worker thread for callers on an event loop.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = b""
+
+    def call(self, cmd, **params):
+        self.sock.sendall(json.dumps({"cmd": cmd, **params}).encode() + b"\n")
+        while b"\n" not in self.buffer:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("agent closed the connection")
+            self.buffer += chunk
+        line, self.buffer = self.buffer.split(b"\n", 1)
+        return json.loads(line)
+
+    async def call_async(self, cmd, **params):
+        return await asyncio.to_thread(self.call, cmd, **params)
+
+    def close(self):
+        self.sock.close()
+
+
+def main(port=AGENT_PORT):
+    log = LogTee(sys.stdout)
+    sys.stdout = log
+    agent = Agent(log, port=port)
+    while True:
+        try:
+            asyncio.run(agent.serve())
+        except SystemExit:
+            # A tool calling sys.exit should only end its own run, not the agent
+            print("[AGENT] A tool asked to exit; its run is over, agent keeps serving")
+            agent.tasks.clear()
+        except KeyboardInterrupt:
+            return
+
+
+if __name__ == "__main__":
+    import socket
+
+    parser = argparse.ArgumentParser(description="Warm Pi-Top tool agent.")
+    parser.add_argument("cmd", nargs="?", default="serve", choices=("serve", "status", "start", "stop"))
+    parser.add_argument("function", nargs="?")
+    parser.add_argument("args", nargs="*")
+    parser.add_argument("--port", type=int, default=AGENT_PORT)
+    options = parser.parse_args()
+    if options.cmd == "serve":
+        main(options.port)
+    else:
+        client = AgentClient(socket.create_connection(("127.0.0.1", options.port)))
+        params = {"function": options.function} if options.function else {}
+        if options.cmd == "start":
+            params["args"] = options.args
+        print(json.dumps(client.call(options.cmd, **params), indent=2))
+        client.close()
@@ -0,0 +1,269 @@
+"""Detection benchmarks on synthetic scenes, no robot or network needed.
+
+Generates frames with known ground truth and runs them through the same
+detection functions the servers use:
+  - OBJDET: one colored blob per COLOR_RANGES entry, drifting at a constant
+    speed inside its own part of the frame, scored by recall (IoU >= 0.5)
+    and mean IoU per box
+  - LNFOL: dark lines of varying curvature and width on a light floor,
+    scored by detection rate and line-center error in pixels
+  - change gate: how many frames of a small ball crossing a noisy floor
+    (all should be sent) and of the still floor (only keyframes should be)
+    the Pi's ChangeGate lets through
+
+Each pipeline reports per-stage times (Pi-side encode, decode, detect),
+frames/s and accuracy at every frame size:
+
+    python -m Tools.bench --frames 100 --sizes 640x480,1280x720
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from Tools.latency import percentile
+from Tools.OBJDET import computer as objdet
+from Tools.OBJDET.tracker import Tracker
+from Tools.LNFOL import computer as lnfol
+from Tools.sender import ChangeGate, TARGET_FPS
+
+SIZES = ((640, 480), (1280, 720))
+FRAMES = 50
+JPEG_QUALITY = 80
+# Change gate scene: ball diameter and speed (pixels per frame)
+BALL_SIZE = 80
+BALL_SPEED = 10
+
+
+def range_center_bgr(name):
+    """BGR color in the middle of a color's (first) HSV range."""
+    lower, upper = objdet.COLOR_RANGES[name][0], objdet.COLOR_RANGES[name][1]
+    hsv = ((lower.astype(np.int32) + upper.astype(np.int32)) // 2).astype(np.uint8)
+    return tuple(int(v) for v in cv2.cvtColor(hsv.reshape(1, 1, 3), cv2.COLOR_HSV2BGR)[0, 0])
+
+
+def blob_scenes(width, height, frames, rng):
+    """Gray, slightly noisy floor with one ellipse per color, each bouncing around its own grid cell.
+
+    Yields (BGR frame, {color: [(x, y, w, h)]}) per frame.
+    """
+    names = list(objdet.COLOR_RANGES)
+    cols = 3
+    rows = (len(names) + cols - 1) // cols
+    cell_w, cell_h = width // cols, height // rows
+    blobs = []
+    for name, cell in zip(names, rng.permutation(cols * rows)):
+        a = int(rng.integers(cell_w // 10, cell_w // 4))
+        b = int(rng.integers(cell_h // 10, cell_h // 4))
+        left, top = (cell % cols) * cell_w + a + 2, (cell // cols) * cell_h + b + 2
+        bounds = (left, top, left + cell_w - 2 * a - 4, top + cell_h - 2 * b - 4)
+        position = np.array((rng.uniform(bounds[0], bounds[2]), rng.uniform(bounds[1], bounds[3])))
+        velocity = rng.uniform(-0.01, 0.01, 2) * width
+        blobs.append([name, a, b, bounds, position, velocity])
+
+    for _ in range(frames):
+        frame = np.full((height, width, 3), 128, np.uint8)
+        frame = cv2.add(frame, rng.integers(0, 6, frame.shape, dtype=np.uint8))
+        truth = {}
+        for name, a, b, bounds, position, velocity in blobs:
+            position += velocity
+            for axis in (0, 1):
+                if not bounds[axis] <= position[axis] <= bounds[axis + 2]:
+                    velocity[axis] = -velocity[axis]
+                    position[axis] = min(max(position[axis], bounds[axis]), bounds[axis + 2])
+            cx, cy = int(position[0]), int(position[1])
+            cv2.ellipse(frame, (cx, cy), (a, b), 0, 0, 360, range_center_bgr(name), -1)
+            truth[name] = [(cx - a, cy - b, 2 * a + 1, 2 * b + 1)]
+        yield frame, truth
+
+
+def line_scene(width, height, rng):
+    """Light floor with one dark curved line.
+
+    Returns (BGR frame, expected line center x in the ROI).
+    """
+    frame = np.full((height, width, 3), 200, np.uint8)
+    frame = cv2.subtract(frame, rng.integers(0, 10, frame.shape, dtype=np.uint8))
+    thickness = int(rng.integers(max(3, width // 80), max(6, width // 20)))
+    base = rng.uniform(0.3, 0.7) * width
+    slope = rng.uniform(-0.4, 0.4)
+    curvature = rng.uniform(-1.5, 1.5) / height
+    ys = np.arange(height)
+    xs = base + slope * (height - ys) + curvature * (height - ys) ** 2
+    points = np.stack((xs, ys), axis=1).astype(np.int32)
+    cv2.polylines(frame, [points], False, (20, 20, 20), thickness)
+    roi_top = int(height * lnfol.ROI_TOP)
+    visible = xs[roi_top:]
+    visible = visible[(visible >= 0) & (visible < width)]
+    return frame, float(visible.mean()) if len(visible) else None
+
+
+def ball_scene(width, height, frames, rng, speed=BALL_SPEED, size=BALL_SIZE):
+    """Noisy gray floor with one red ball crossing it at speed pixels per frame (0 = no ball)."""
+    for i in range(frames):
+        frame = np.full((height, width, 3), 128, np.uint8)
+        frame = cv2.add(frame, rng.integers(0, 6, frame.shape, dtype=np.uint8))
+        if speed:
+            x = size + (i * speed) % (width - 2 * size)
+            cv2.circle(frame, (x, height // 2), size // 2, range_center_bgr("red"), -1)
+        yield frame
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = min(ax + aw, bx + bw) - max(ax, bx)
+    h = min(ay + ah, by + bh) - max(ay, by)
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / (aw * ah + bw * bh - inter)
+
+
+def score_objects(found, truth):
+    """Returns (matched boxes, total boxes, summed best IoU)."""
+    matched, total, iou_sum = 0, 0, 0.0
+    for name, boxes in truth.items():
+        for box in boxes:
+            total += 1
+            best = max((iou(box, f) for f in found.get(name, [])), default=0.0)
+            iou_sum += best
+            matched += best >= 0.5
+    return matched, total, iou_sum
+
+
+def encode(frame, quality=JPEG_QUALITY):
+    start = time.perf_counter()
+    ok, jpeg = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    return jpeg.tobytes(), time.perf_counter() - start
+
+
+def encode_gray_roi(frame, quality=JPEG_QUALITY):
+    """What the LNFOL Pi client sends in "gray_roi" mode."""
+    start = time.perf_counter()
+    roi = cv2.cvtColor(frame[int(frame.shape[0] * lnfol.ROI_TOP):], cv2.COLOR_BGR2GRAY)
+    ok, jpeg = cv2.imencode(".jpg", roi, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    return jpeg.tobytes(), time.perf_counter() - start
+
+
+class Result:
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.stages = {"encode": [], "decode": [], "detect": []}
+        self.bytes = 0
+        self.score = [0, 0, 0.0]
+
+    def add(self, encode_time, timings, size):
+        self.stages["encode"].append(encode_time)
+        self.stages["decode"].append(timings[0])
+        self.stages["detect"].append(timings[1])
+        self.bytes += size
+
+    def row(self):
+        frames = len(self.stages["detect"])
+        p50 = {stage: percentile(sorted(t), 0.5) * 1000 for stage, t in self.stages.items()}
+        busy = sum(self.stages["decode"]) + sum(self.stages["detect"])
+        fps = frames / busy if busy else 0.0
+        return (f"{self.name:<24} {self.size[0]}x{self.size[1]:<5} "
+                f"{p50['encode']:7.2f} {p50['decode']:7.2f} {p50['detect']:7.2f} "
+                f"{fps:8.1f} {self.bytes / max(1, frames) / 1024:7.1f}  {self.accuracy()}")
+
+
+class ObjectResult(Result):
+    def accuracy(self):
+        matched, total, iou_sum = self.score
+        return f"recall {matched / max(1, total):.2f}, mean IoU {iou_sum / max(1, total):.2f}"
+
+
+class LineResult(Result):
+    def accuracy(self):
+        found, total, error_sum = self.score
+        return f"found {found / max(1, total):.2f}, center error {error_sum / max(1, found):.1f} px"
+
+
+def bench_objects(size, frames, rng):
+    # Headless, as on the processing boxes: detection only, no drawing
+    pipelines = [
+        ("objdet lut (6 colors)", objdet.detect_all_colors, None),
+        ("objdet lut tracked", objdet.detect_all_colors, Tracker()),
+        # The "single" engine: one HSV pipeline per color
+        ("objdet single x6", objdet.detect_colors, None),
+        ("objdet single tracked", objdet.detect_colors, Tracker()),
+    ]
+    results = [ObjectResult(name, size) for name, _, _ in pipelines]
+    for seq, (frame, truth) in enumerate(blob_scenes(size[0], size[1], frames, rng)):
+        data, encode_time = encode(frame)
+        for result, (_, detect, tracker) in zip(results, pipelines):
+            if tracker is None:
+                _, found, timings = objdet.process_frame(detect, data, False)
+            else:
+                windows = tracker.plan(seq)
+                _, found, timings = objdet.process_frame(
+                    objdet.detect_in_windows, data, windows, size[0], detect,
+                    False, None, objdet.DETECTION_THRESHOLD)
+                tracker.update(seq, found, windows is None)
+            result.add(encode_time, timings, len(data))
+            for i, value in enumerate(score_objects(found, truth)):
+                result.score[i] += value
+    return results
+
+
+def bench_lines(size, frames, rng):
+    hello = {"frame_size": size, "stream": "gray_roi", "roi_top": int(size[1] * lnfol.ROI_TOP)}
+    pipelines = [
+        ("lnfol color", encode, {"stream": "color"}, lnfol.detect_line),
+        ("lnfol gray_roi", encode_gray_roi, hello, lnfol.detect_line),
+        ("lnfol gray_roi scanline", encode_gray_roi, hello, lnfol.detect_scanlines),
+    ]
+    results = [LineResult(name, size) for name, _, _, _ in pipelines]
+    for _ in range(frames):
+        frame, expected = line_scene(size[0], size[1], rng)
+        for result, (_, encoder, stream, detect) in zip(results, pipelines):
+            data, encode_time = encoder(frame)
+            _, (line_center, _, _), timings = lnfol.process_frame(detect, data, stream, False)
+            result.add(encode_time, timings, len(data))
+            if expected is None:
+                continue
+            result.score[1] += 1
+            if line_center is not None:
+                result.score[0] += 1
+                result.score[2] += abs(line_center[0] - expected)
+    return results
+
+
+def bench_gate(size, frames, rng):
+    """(frames sent of the moving ball, frames sent of the still floor) at the sender's frame rate."""
+    sent = []
+    for speed in (BALL_SPEED, 0):
+        gate = ChangeGate()
+        sent.append(sum(gate.changed(frame, i / TARGET_FPS)
+                        for i, frame in enumerate(ball_scene(size[0], size[1], frames, rng, speed))))
+    return sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the OBJDET and LNFOL detection pipelines.")
+    parser.add_argument("--frames", type=int, default=FRAMES, help="synthetic frames per size")
+    parser.add_argument("--sizes", default=",".join(f"{w}x{h}" for w, h in SIZES))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    sizes = [tuple(int(v) for v in s.split("x")) for s in args.sizes.split(",")]
+    rng = np.random.default_rng(args.seed)
+
+    print(f"{'pipeline':<24} {'size':<10} {'enc ms':>6} {'dec ms':>7} {'det ms':>7} "
+          f"{'frames/s':>8} {'KB/frm':>7}  accuracy")
+    for size in sizes:
+        for result in bench_objects(size, args.frames, rng) + bench_lines(size, args.frames, rng):
+            print(result.row())
+    for size in sizes:
+        moving, still = bench_gate(size, args.frames, rng)
+        keyframes = int(np.ceil(args.frames / TARGET_FPS))
+        print(f"change gate {size[0]}x{size[1]}: {BALL_SIZE} px ball at {BALL_SPEED} px/frame "
+              f"sent {moving}/{args.frames}, still floor sent {still}/{args.frames} "
+              f"(keyframes {keyframes})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Adaptive bitrate control for the Pi's JPEG streams.
+
+The controller watches how long writer.drain() stalls and, where the
+server replies, the capture -> reply round trip. When latency climbs past
+TARGET_LATENCY it steps down JPEG quality first, then resolution, then
+frame rate; once latency is comfortably under target it steps back up in
+the reverse order. Every setting stays inside its configured bounds.
+"""
+import statistics
+import time
+from collections import deque
+
+TARGET_LATENCY = 0.15  # seconds
+QUALITY_RANGE = (30, 85)
+SCALE_RANGE = (0.5, 1.0)
+FPS_RANGE = (10, 30)
+
+QUALITY_STEP = 10
+SCALE_STEP = 0.125
+FPS_STEP = 5
+# Seconds between adjustments, so each change has time to show its effect
+ADJUST_INTERVAL = 1.0
+# Step back up only when latency is below this fraction of the target
+RECOVER_FRACTION = 0.6
+
+
+class BitrateController:
+    """Picks JPEG quality, resolution scale and frame rate from observed latency."""
+
+    def __init__(self, target=TARGET_LATENCY, quality_range=QUALITY_RANGE,
+                 scale_range=SCALE_RANGE, fps_range=FPS_RANGE, name="STREAM"):
+        self.target = target
+        self.quality_range = quality_range
+        self.scale_range = scale_range
+        self.fps_range = fps_range
+        self.name = name
+        self.quality = quality_range[1]
+        self.scale = scale_range[1]
+        self.fps = fps_range[1]
+        self.drains = deque(maxlen=30)
+        self.rtts = deque(maxlen=30)
+        self.last_adjust = time.monotonic()
+
+    def observe_drain(self, seconds):
+        self.drains.append(seconds)
+        self.maybe_adjust()
+
+    def observe_rtt(self, seconds):
+        self.rtts.append(seconds)
+        self.maybe_adjust()
+
+    def latency(self):
+        """Current latency estimate, or None without samples."""
+        estimates = [statistics.median(s) for s in (self.drains, self.rtts) if s]
+        return max(estimates) if estimates else None
+
+    def maybe_adjust(self):
+        now = time.monotonic()
+        if now - self.last_adjust < ADJUST_INTERVAL:
+            return
+        latency = self.latency()
+        if latency is None:
+            return
+        self.last_adjust = now
+
+        before = (self.quality, self.scale, self.fps)
+        if latency > self.target:
+            self.degrade()
+        elif latency < self.target * RECOVER_FRACTION:
+            self.improve()
+        if (self.quality, self.scale, self.fps) != before:
+            print(f"[BITRATE {self.name}] latency {latency * 1000:.0f} ms -> "
+                  f"quality {self.quality}, scale {self.scale:.3g}, {self.fps} fps")
+            # Judge the new settings on fresh samples only
+            self.drains.clear()
+            self.rtts.clear()
+
+    def degrade(self):
+        if self.quality > self.quality_range[0]:
+            self.quality = max(self.quality_range[0], self.quality - QUALITY_STEP)
+        elif self.scale > self.scale_range[0]:
+            self.scale = max(self.scale_range[0], self.scale - SCALE_STEP)
+        elif self.fps > self.fps_range[0]:
+            self.fps = max(self.fps_range[0], self.fps - FPS_STEP)
+
+    def improve(self):
+        if self.fps < self.fps_range[1]:
+            self.fps = min(self.fps_range[1], self.fps + FPS_STEP)
+        elif self.scale < self.scale_range[1]:
+            self.scale = min(self.scale_range[1], self.scale + SCALE_STEP)
+        elif self.quality < self.quality_range[1]:
+            self.quality = min(self.quality_range[1], self.quality + QUALITY_STEP)
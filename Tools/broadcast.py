@@ -0,0 +1,83 @@
+"""One producer, many subscribers, each getting only the newest item.
+
+A Broadcaster runs a blocking producer (camera capture + encode, sensor
+reads) in its own thread at a paced rate, and only while someone is
+subscribed. Every result goes to each subscriber's one-slot FrameQueue, so
+a slow subscriber just skips items (its `dropped` count goes up) without
+holding back the producer or the other subscribers. Adding a subscriber
+costs its network I/O only.
+"""
+import asyncio
+import threading
+
+from Tools.ingest import FrameQueue
+from Tools.sender import Pacer, TARGET_FPS
+
+
+class Broadcaster:
+    """Shares the output of produce() between asyncio subscribers.
+
+    produce() runs in the broadcaster thread and returns the item to
+    publish, or None to publish nothing this tick. With a controller
+    (e.g. BitrateController) the rate follows controller.fps.
+    """
+
+    def __init__(self, produce, fps=TARGET_FPS, controller=None, name="BROADCAST"):
+        self.produce = produce
+        self.pacer = Pacer(fps)
+        self.controller = controller
+        self.name = name
+        self.subscribers = set()
+        self.loop = None
+        self.thread = None
+        self.running = False
+        self.wanted = threading.Event()  # set while anyone is subscribed
+
+    def subscribe(self):
+        """Register a subscriber (call from the event loop); returns its FrameQueue."""
+        queue = FrameQueue(1)
+        self.subscribers.add(queue)
+        self.wanted.set()
+        # A tool can be run again on a new event loop (under the agent) after stop()
+        self.loop = asyncio.get_running_loop()
+        if not self.running or self.thread is None or not self.thread.is_alive():
+            self.running = True
+            self.thread = threading.Thread(target=self.run, name=self.name.lower(), daemon=True)
+            self.thread.start()
+        print(f"[{self.name}] {len(self.subscribers)} subscriber(s)")
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+        queue.close()
+        if not self.subscribers:
+            self.wanted.clear()
+        print(f"[{self.name}] Subscriber left ({queue.dropped} items skipped), "
+              f"{len(self.subscribers)} remaining")
+
+    def publish(self, item):
+        for queue in list(self.subscribers):
+            queue.put(item)
+
+    def run(self):
+        # A thread left over from before stop() ends once it sees its replacement
+        while self.running and self.thread is threading.current_thread():
+            # Idle without subscribers instead of capturing for nobody
+            if not self.wanted.wait(0.5):
+                continue
+            if self.controller is not None:
+                self.pacer.fps = self.controller.fps
+            self.pacer.wait()
+            item = self.produce()
+            if item is None:
+                continue
+            try:
+                self.loop.call_soon_threadsafe(self.publish, item)
+            except RuntimeError:
+                return  # event loop closed
+
+    def stop(self):
+        self.running = False
+        self.wanted.set()
+        for queue in list(self.subscribers):
+            queue.close()
@@ -0,0 +1,347 @@
+"""Hardware broker: one process owns the Pi-Top camera and sensors, every tool reads them.
+
+Start it once on the Pi (`python -m Tools.broker`, or BROKER in main.py).
+It captures CAMERA_FPS frames a second into a ring of RING_SLOTS frame
+slots in shared memory (CAMERA_SHM), and samples the ultrasonic sensors on
+ULTRASONIC_PORTS at SENSOR_HZ into small shared structs (SENSOR_SHM). The tools' pt.py files
+get their devices from open_camera() / open_ultrasonic(): while the broker
+runs these attach to shared memory, so any number of tools share one
+capture. Without a broker they fall back to opening the device directly.
+
+Camera segment layout (all int64, native byte order):
+  HEADER  magic, width, height, channels, slots, latest seq (-1 = none), 2 spare
+  META    slots x (seq, capture time in monotonic ns); seq -1 while being written
+  FRAMES  slots x height x width x channels uint8 RGB pixels
+Frame seq lands in slot seq % slots, so a frame handed out by read() stays
+intact for the next RING_SLOTS - 1 captures; valid(seq) tells whether it
+still is. Readers that keep a frame longer should copy it.
+
+Sensor segment: SENSOR_HEADER (number of ports), then one slot per port:
+a SEQLOCK counter followed by the SENSOR struct (sample time, distance,
+port). A counter is odd while the broker writes its slot; readers retry
+until they see the same even value before and after reading.
+"""
+import argparse
+import struct
+import threading
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+from Tools.sender import Pacer
+from Tools.startup import lazy_import
+
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+
+CAMERA_SHM = "pitop_camera"
+SENSOR_SHM = "pitop_sensors"
+CAMERA_RESOLUTION = (1280, 720)
+CAMERA_FPS = 30
+RING_SLOTS = 6
+# USM's sensor is on D2, RC's on D3
+ULTRASONIC_PORTS = ("D2", "D3")
+SENSOR_HZ = 20
+# How long get_frame() waits for a newer frame before handing out the last one again
+FRAME_TIMEOUT = 1.0
+# Readers refuse to attach when the newest frame/sample is older than this
+# (seconds): the segment was left behind by a broker that was killed
+STALE_AFTER = 2.0
+
+MAGIC = 0x50544252  # "PTBR"
+HEADER_FIELDS = 8
+LATEST = 5
+SENSOR_HEADER = struct.Struct("=q")  # number of port slots
+SEQLOCK = struct.Struct("=q")
+SENSOR = struct.Struct("=dd8s")  # sample time (monotonic s), distance (m), port; after SEQLOCK
+SENSOR_SLOT = SEQLOCK.size + SENSOR.size
+
+
+def attach(name):
+    """Open an existing shared memory segment without taking ownership of it.
+
+    Before Python 3.13 every process that opens a segment registers it with
+    its resource tracker, which unlinks it when that process exits, which
+    would pull the segment out from under the broker.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def create(name, size):
+    """Create a segment, replacing one left behind by a broker that crashed."""
+    try:
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+        stale = shared_memory.SharedMemory(name=name)
+        stale.close()
+        stale.unlink()
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+
+
+class FrameRing:
+    """Views into a camera segment (see the module docstring for the layout)."""
+
+    def __init__(self, shm):
+        self.shm = shm
+        self.header = np.ndarray((HEADER_FIELDS,), np.int64, buffer=shm.buf)
+        if self.header[0] != MAGIC:
+            raise ValueError(f"{shm.name} is not a camera segment")
+        width, height, channels, slots = (int(v) for v in self.header[1:5])
+        self.shape = (height, width, channels)
+        self.slots = slots
+        offset = self.header.nbytes
+        self.meta = np.ndarray((slots, 2), np.int64, buffer=shm.buf, offset=offset)
+        offset += self.meta.nbytes
+        self.frames = np.ndarray((slots, *self.shape), np.uint8, buffer=shm.buf, offset=offset)
+
+    @staticmethod
+    def size(resolution, channels=3, slots=RING_SLOTS):
+        width, height = resolution
+        return 8 * (HEADER_FIELDS + 2 * slots) + slots * width * height * channels
+
+    @classmethod
+    def create(cls, name, resolution, channels=3, slots=RING_SLOTS):
+        shm = create(name, cls.size(resolution, channels, slots))
+        header = np.ndarray((HEADER_FIELDS,), np.int64, buffer=shm.buf)
+        header[:] = (MAGIC, resolution[0], resolution[1], channels, slots, -1, 0, 0)
+        ring = cls(shm)
+        ring.meta[:] = -1
+        return ring
+
+    def write(self, seq, rgb, capture_ns):
+        slot = seq % self.slots
+        self.meta[slot, 0] = -1
+        frame = np.asarray(rgb)
+        if frame.shape != self.shape:
+            frame = cv2.resize(frame, (self.shape[1], self.shape[0]), interpolation=cv2.INTER_AREA)
+        self.frames[slot] = frame
+        self.meta[slot, 1] = capture_ns
+        self.meta[slot, 0] = seq
+        self.header[LATEST] = seq
+
+    def read(self):
+        """(seq, capture time, frame view) of the newest frame, or None before the first one."""
+        while True:
+            seq = int(self.header[LATEST])
+            if seq < 0:
+                return None
+            slot = seq % self.slots
+            capture_ns = int(self.meta[slot, 1])
+            if self.meta[slot, 0] == seq:
+                return seq, capture_ns / 1e9, self.frames[slot]
+            # The broker lapped us while we read: take the newer frame
+
+    def valid(self, seq):
+        """True while frame seq has not been overwritten."""
+        return self.meta[seq % self.slots, 0] == seq
+
+    def close(self):
+        # Views into the buffer must go before the segment can be closed
+        self.header = self.meta = self.frames = None
+        self.shm.close()
+
+
+def fit(frame, resolution):
+    """Center-crop frame to the aspect ratio of resolution (width, height), then resize to it.
+
+    The broker captures 16:9 while OBJDET and LNFOL ask for 4:3; squashing
+    instead of cropping would distort boxes and line angles.
+    """
+    width, height = resolution
+    rows, cols = frame.shape[:2]
+    if cols * height > width * rows:
+        crop = round(rows * width / height)
+        left = (cols - crop) // 2
+        frame = frame[:, left:left + crop]
+    elif cols * height < width * rows:
+        crop = round(cols * height / width)
+        top = (rows - crop) // 2
+        frame = frame[top:top + crop]
+    return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+
+class BrokerCamera:
+    """Drop-in for pitop's Camera that reads frames published by the broker.
+
+    get_frame() returns an RGB array. At the broker's resolution it is a
+    zero-copy view into shared memory; otherwise it is center-cropped to the
+    requested aspect ratio and resized (see fit()).
+    """
+
+    def __init__(self, resolution=None, name=CAMERA_SHM):
+        self.ring = FrameRing(attach(name))
+        item = self.ring.read()
+        if item is None or time.monotonic() - item[1] > STALE_AFTER:
+            self.ring.close()
+            raise ValueError(f"no recent frames in {name}, is the broker running?")
+        self.resolution = resolution
+        self.last_seq = -1
+        self.capture_time = None
+
+    def read(self):
+        return self.ring.read()
+
+    def valid(self, seq):
+        return self.ring.valid(seq)
+
+    def get_frame(self):
+        """Wait for a frame newer than the last one returned (up to FRAME_TIMEOUT)."""
+        deadline = time.monotonic() + FRAME_TIMEOUT
+        while True:
+            item = self.ring.read()
+            if item is not None and (item[0] > self.last_seq or time.monotonic() > deadline):
+                break
+            time.sleep(0.002)
+        self.last_seq, self.capture_time, frame = item
+        if self.resolution is not None and tuple(self.resolution) != (frame.shape[1], frame.shape[0]):
+            frame = fit(frame, tuple(self.resolution))
+        return frame
+
+    def close(self):
+        self.ring.close()
+
+
+class SensorBlock:
+    """The broker's sensor slots in shared memory, one per ultrasonic port."""
+
+    def __init__(self, shm):
+        self.shm = shm
+        (self.slots,) = SENSOR_HEADER.unpack_from(shm.buf)
+        self.counters = [0] * self.slots
+
+    @classmethod
+    def create(cls, name, ports):
+        shm = create(name, SENSOR_HEADER.size + len(ports) * SENSOR_SLOT)
+        SENSOR_HEADER.pack_into(shm.buf, 0, len(ports))
+        block = cls(shm)
+        for slot, port in enumerate(ports):
+            block.write(slot, 0.0, float("nan"), port)
+        return block
+
+    def offset(self, slot):
+        return SENSOR_HEADER.size + slot * SENSOR_SLOT
+
+    def write(self, slot, now, distance, port):
+        offset = self.offset(slot)
+        self.counters[slot] += 1
+        SEQLOCK.pack_into(self.shm.buf, offset, self.counters[slot])  # odd: writing
+        SENSOR.pack_into(self.shm.buf, offset + SEQLOCK.size, now, distance, port.encode())
+        self.counters[slot] += 1
+        SEQLOCK.pack_into(self.shm.buf, offset, self.counters[slot])
+
+    def close(self):
+        self.shm.close()
+
+    def read(self, slot):
+        """(sample time, distance, port) from a consistent snapshot of a slot."""
+        offset = self.offset(slot)
+        while True:
+            (before,) = SEQLOCK.unpack_from(self.shm.buf, offset)
+            if before % 2:
+                continue
+            now, distance, port = SENSOR.unpack_from(self.shm.buf, offset + SEQLOCK.size)
+            if SEQLOCK.unpack_from(self.shm.buf, offset)[0] == before:
+                return now, distance, port.rstrip(b"\0").decode()
+
+    def ports(self):
+        return [self.read(slot)[2] for slot in range(self.slots)]
+
+
+class BrokerUltrasonic:
+    """Drop-in for pitop's UltrasonicSensor reading the broker's samples."""
+
+    def __init__(self, port, name=SENSOR_SHM):
+        self.block = SensorBlock(attach(name))
+        ports = self.block.ports()
+        if port not in ports:
+            self.block.close()
+            raise ValueError(f"broker samples the ultrasonic sensors on {', '.join(ports)}, not {port}")
+        self.slot = ports.index(port)
+        if time.monotonic() - self.block.read(self.slot)[0] > STALE_AFTER:
+            self.block.close()
+            raise ValueError(f"no recent samples in {name}, is the broker running?")
+
+    @property
+    def distance(self):
+        return self.block.read(self.slot)[1]
+
+
+def open_camera(resolution):
+    """The broker's camera if it is running, else the Pi-Top camera itself."""
+    try:
+        camera = BrokerCamera(resolution)
+        print(f"[BROKER] Using shared camera at {camera.ring.shape[1]}x{camera.ring.shape[0]}")
+        return camera
+    except (FileNotFoundError, ValueError):
+        from pitop import Camera
+        return Camera(resolution=resolution)
+
+
+def open_ultrasonic(port, **kwargs):
+    """The broker's ultrasonic samples for port if it is running, else the sensor itself."""
+    try:
+        sensor = BrokerUltrasonic(port)
+        print(f"[BROKER] Using shared ultrasonic sensor on {port}")
+        return sensor
+    except (FileNotFoundError, ValueError):
+        from pitop import UltrasonicSensor
+        return UltrasonicSensor(port, **kwargs)
+
+
+def sample_sensors(sensors, block, hz, running):
+    """Read every sensor in ports order (one slot each) hz times a second."""
+    pacer = Pacer(hz)
+    while running.is_set():
+        pacer.wait()
+        for slot, (port, sensor) in enumerate(sensors):
+            distance = sensor.distance
+            block.write(slot, time.monotonic(), distance, port)
+
+
+def main(resolution=CAMERA_RESOLUTION, fps=CAMERA_FPS, ports=ULTRASONIC_PORTS, slots=RING_SLOTS):
+    """Run the broker until interrupted."""
+    from pitop import Camera, UltrasonicSensor
+
+    camera = Camera(resolution=resolution)
+    ring = FrameRing.create(CAMERA_SHM, resolution, slots=slots)
+    block = None
+    running = threading.Event()
+    running.set()
+    if ports:
+        block = SensorBlock.create(SENSOR_SHM, ports)
+        sensors = [(port, UltrasonicSensor(port)) for port in ports]
+        threading.Thread(target=sample_sensors, args=(sensors, block, SENSOR_HZ, running),
+                         name="broker-sensors", daemon=True).start()
+    print(f"[BROKER] Publishing {resolution[0]}x{resolution[1]} frames at {fps} fps"
+          + (f" and ultrasonic {', '.join(ports)} at {SENSOR_HZ} Hz" if ports else ""))
+    pacer = Pacer(fps)
+    seq = 0
+    try:
+        while True:
+            pacer.wait()
+            ring.write(seq, camera.get_frame(), time.monotonic_ns())
+            seq += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        running.clear()
+        print(f"[BROKER] Stopped after {seq} frames")
+        for owner in (ring, block):
+            if owner is not None:
+                owner.shm.unlink()
+                owner.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Share the Pi-Top camera and sensors between tools.")
+    parser.add_argument("--resolution", default="x".join(map(str, CAMERA_RESOLUTION)))
+    parser.add_argument("--fps", type=int, default=CAMERA_FPS)
+    parser.add_argument("--ultrasonic", default=",".join(ULTRASONIC_PORTS),
+                        help="comma-separated sensor ports, empty for none")
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.resolution.split("x"))
+    main((width, height), args.fps, [port for port in args.ultrasonic.split(",") if port])
@@ -0,0 +1,122 @@
+"""Latest-frame-wins ingest for the computer-side detection servers.
+
+The Pi streams frames faster than detection may keep up with. Instead of
+letting the TCP buffer fill with stale frames, a reader task keeps draining
+the socket into a small FrameQueue that throws away the oldest frames, so
+the processor always picks up the newest one.
+"""
+import asyncio
+import json
+import time
+from collections import deque, namedtuple
+from Tools.protocol import HELLO_MAGIC, FRAME, SIZE, PROTOCOL_VERSION, FLAG_REPEAT
+
+# Frames kept waiting for the processor; 1 = always process the newest frame
+INGEST_DEPTH = 1
+
+# seq / capture_time come from the Pi on tagged streams; legacy streams get a
+# local counter and capture_time 0.0. received is the local monotonic time.
+Frame = namedtuple("Frame", "seq capture_time data flags received")
+
+
+class FrameQueue:
+    """Bounded queue that drops the oldest frame instead of blocking the reader."""
+
+    def __init__(self, maxsize=INGEST_DEPTH):
+        self.frames = deque(maxlen=maxsize)
+        self.hello = None  # client hello ({} for legacy clients), set before the first frame
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.received = 0
+        self.dropped = 0
+
+    def put(self, frame):
+        # A repeat must not push out the real frame it repeats: keep that
+        # frame's pixels under the repeat's seq and timestamp instead
+        if (isinstance(frame, Frame) and frame.flags & FLAG_REPEAT
+                and self.frames and not self.frames[-1].flags & FLAG_REPEAT):
+            frame = self.frames.pop()._replace(
+                seq=frame.seq, capture_time=frame.capture_time, received=frame.received)
+        if len(self.frames) == self.frames.maxlen:
+            self.dropped += 1
+        self.frames.append(frame)
+        self.received += 1
+        self.ready.set()
+
+    async def get(self):
+        """Wait for the next frame. Returns None once closed and empty."""
+        while not self.frames:
+            if self.closed:
+                return None
+            self.ready.clear()
+            await self.ready.wait()
+        return self.frames.popleft()
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+
+
+def frame_scale(hello, width):
+    """Factor that maps pixels of a received frame back to the Pi's full frame size.
+
+    Pi clients that downscale frames report the full size in their hello.
+    """
+    frame_size = (hello or {}).get("frame_size")
+    if not frame_size or not width:
+        return 1.0
+    return frame_size[0] / width
+
+
+async def read_payload(reader, size, stats=None):
+    start = time.monotonic()
+    data = await reader.readexactly(size)
+    if stats is not None:
+        stats.record("recv", time.monotonic() - start)
+    return data
+
+
+async def read_frames(reader, queue, stats=None, recorder=None):
+    """Drain frames from the socket into queue until the client leaves.
+
+    Accepts both tagged streams (opened with a hello) and legacy
+    length-prefixed ones. If stats is given, payload read time is recorded
+    under "recv"; if recorder is given, every received frame is recorded.
+    """
+    try:
+        header = await reader.readexactly(4)
+        if header == HELLO_MAGIC:
+            (size,) = SIZE.unpack(await reader.readexactly(SIZE.size))
+            queue.hello = json.loads((await reader.readexactly(size)).decode())
+            if recorder is not None:
+                recorder.start(queue.hello)
+            while True:
+                version, flags, seq, capture_time, size = FRAME.unpack(await reader.readexactly(FRAME.size))
+                if version != PROTOCOL_VERSION:
+                    print(f"[FRAME] Unsupported frame version {version}, closing")
+                    return
+                data = await read_payload(reader, size, stats)
+                frame = Frame(seq, capture_time, data, flags, time.monotonic())
+                if recorder is not None:
+                    recorder.write(frame)
+                queue.put(frame)
+
+        queue.hello = {}
+        if recorder is not None:
+            recorder.start(queue.hello)
+        seq = 0
+        while True:
+            (frame_size,) = SIZE.unpack(header)
+            data = await read_payload(reader, frame_size, stats)
+            frame = Frame(seq, 0.0, data, 0, time.monotonic())
+            if recorder is not None:
+                recorder.write(frame)
+            queue.put(frame)
+            seq += 1
+            header = await reader.readexactly(4)
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        pass
+    finally:
+        queue.close()
+        if recorder is not None:
+            recorder.close()
@@ -0,0 +1,97 @@
+"""Per-stage latency statistics for the frame -> detection round trip.
+
+Pi side stages:       capture, encode, send, network, rtt (capture -> reply received)
+Computer side stages: recv, wait (received -> handed to a worker), decode, detect, reply
+
+The server sends its wait/decode/detect times back with every reply, so the Pi
+can split its round trip into network time and server time.
+"""
+import time
+from collections import deque
+
+# Samples kept per stage, and seconds between printed reports
+STATS_WINDOW = 300
+REPORT_INTERVAL = 5.0
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class LatencyStats:
+    """Rolling window of timings per stage with periodic p50/p95/p99 reports."""
+
+    def __init__(self, name, window=STATS_WINDOW, report_interval=REPORT_INTERVAL):
+        self.name = name
+        self.window = window
+        self.report_interval = report_interval
+        self.samples = {}
+        self.last_report = time.monotonic()
+
+    def record(self, stage, seconds):
+        if stage not in self.samples:
+            self.samples[stage] = deque(maxlen=self.window)
+        self.samples[stage].append(seconds)
+
+    def percentiles(self):
+        """Return {stage: (p50, p95, p99, samples)} in seconds."""
+        result = {}
+        for stage, samples in self.samples.items():
+            ordered = sorted(samples)
+            result[stage] = (
+                percentile(ordered, 0.50),
+                percentile(ordered, 0.95),
+                percentile(ordered, 0.99),
+                len(ordered),
+            )
+        return result
+
+    def report(self):
+        lines = [f"[LATENCY {self.name}] stage      p50 ms   p95 ms   p99 ms      n"]
+        for stage, (p50, p95, p99, count) in self.percentiles().items():
+            lines.append(f"[LATENCY {self.name}] {stage:<9} {p50 * 1000:8.1f} {p95 * 1000:8.1f} {p99 * 1000:8.1f} {count:6d}")
+        return "\n".join(lines)
+
+    def maybe_report(self):
+        """Print a report if REPORT_INTERVAL has passed since the last one."""
+        now = time.monotonic()
+        if now - self.last_report >= self.report_interval and self.samples:
+            self.last_report = now
+            print(self.report())
+
+
+def remember_sent(sent_times, seq, sent, limit=STATS_WINDOW):
+    """Store when frame seq finished sending, forgetting the oldest past limit."""
+    sent_times[seq] = sent
+    while len(sent_times) > limit:
+        del sent_times[next(iter(sent_times))]
+
+
+def record_reply(stats, data, sent_times, now=None):
+    """Record round-trip stages for a detection reply on the Pi.
+
+    sent_times maps frame seq -> time the frame finished sending; the entry
+    for the reply is removed, along with any older frames that never got one.
+    """
+    if now is None:
+        now = time.monotonic()
+    seq = data.get("seq")
+    capture_time = data.get("capture_time")
+    if seq is None or not capture_time:
+        return
+    stats.record("rtt", now - capture_time)
+
+    sent = sent_times.pop(seq, None)
+    for old in [s for s in sent_times if s < seq]:
+        del sent_times[old]
+    timings = data.get("timings")
+    if timings:
+        for stage, seconds in zip(("wait", "decode", "detect"), timings):
+            stats.record(stage, seconds)
+        if sent is not None:
+            stats.record("network", max(0.0, now - sent - sum(timings)))
+    stats.maybe_report()
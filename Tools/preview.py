@@ -0,0 +1,82 @@
+"""Debug preview windows for the detection servers, off the frame path.
+
+Frame handlers hand their latest annotated frame to a Preview and move on;
+a single background thread owns every OpenCV window and redraws them at no
+more than PREVIEW_FPS. A frame that arrives before the previous one was
+shown simply replaces it, so slow window rendering never holds up
+detection. Pressing 'q' in any window asks every open stream to stop.
+"""
+import threading
+import time
+
+import cv2
+
+PREVIEW_FPS = 15
+
+
+class Preview:
+    """Shows the newest frame per window from its own thread."""
+
+    def __init__(self, fps=PREVIEW_FPS):
+        self.interval = 1.0 / fps
+        self.lock = threading.Lock()
+        self.latest = {}      # window name -> frame not shown yet
+        self.open = set()     # windows currently on screen
+        self.closing = set()  # windows to destroy on the next pass
+        self.quit = set()     # windows whose stream should stop
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="preview", daemon=True)
+        self.thread.start()
+        print(f"[PREVIEW] Showing frames at up to {1.0 / self.interval:.0f} fps")
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def show(self, name, frame):
+        """Queue a frame for a window; replaces any frame not shown yet."""
+        with self.lock:
+            self.latest[name] = frame
+            self.closing.discard(name)
+
+    def close(self, name):
+        with self.lock:
+            self.latest.pop(name, None)
+            self.quit.discard(name)
+            self.closing.add(name)
+
+    def quit_requested(self, name):
+        with self.lock:
+            return name in self.quit
+
+    def run(self):
+        # Every cv2 GUI call happens on this thread
+        while self.running:
+            started = time.monotonic()
+            with self.lock:
+                frames, self.latest = self.latest, {}
+                closing, self.closing = self.closing & self.open, set()
+            for name in closing:
+                cv2.destroyWindow(name)
+                self.open.discard(name)
+            try:
+                for name, frame in frames.items():
+                    cv2.imshow(name, frame)
+                    self.open.add(name)
+            except cv2.error as e:
+                # No GUI backend (e.g. opencv-python-headless): keep detecting without a preview
+                print(f"[PREVIEW] Cannot open a window, preview disabled (set HEADLESS = True): {e}")
+                self.running = False
+                break
+            if self.open and cv2.waitKey(1) & 0xFF == ord('q'):
+                print("User requested exit (q).")
+                with self.lock:
+                    self.quit.update(self.open)
+            time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+        if self.open:
+            cv2.destroyAllWindows()
@@ -0,0 +1,231 @@
+"""Wire formats shared by the Pi-Top clients and the computer-side servers.
+
+Frame channel (Pi -> computer):
+  legacy  >I size + JPEG
+  tagged  HELLO_MAGIC + >I size + JSON hello, once per connection, then
+          FRAME header (version, flags, seq, capture time, size) + JPEG per frame
+          The hello's "stream" picks the payload: "color" JPEG (default),
+          "gray_roi" single-channel JPEG of the bottom rows from "roi_top",
+          or "raw_roi" RAW header + packed grayscale rows from "roi_top".
+          "session" ties the stream to its control channel (see session.py);
+          OBJDET also takes "colors" (names to detect) and "threshold"
+          (minimum object area in pixels).
+
+Control channel:
+  Pi -> computer: an optional hello (same format) with the "session" ID
+  right after connecting, nothing else.
+  computer -> Pi: every message is >I size + payload. JSON payloads start with "{", binary
+  ones start with PROTOCOL_VERSION, so readers can always fall back to JSON.
+
+Binary detection messages are a MESSAGE header (version, kind, seq, capture
+time, item count) followed by fixed-layout items:
+  KIND_OBJECTS  count x (label, x, y, w, h) as int16, label indexes COLOR_NAMES
+  KIND_LINE     count = 0 (no line) or 1 x (cx, cy, error) as int16
+  KIND_TRACKS   count x (label, track id, x, y, w, h) as int16 (OBJDET with tracking)
+  KIND_PATH     LINE item, PATH (heading, curvature), then count x (x, y) as
+                int16 row centers, nearest row first (LNFOL scanline engine)
+and optionally a TIMING trailer with the server's wait/decode/detect times.
+"""
+import asyncio
+import json
+import struct
+
+PROTOCOL_VERSION = 1
+HELLO_MAGIC = b"PTH1"
+
+SIZE = struct.Struct(">I")
+FRAME = struct.Struct(">BBIdI")  # version, flags, seq, capture time (Pi monotonic clock), size
+MESSAGE = struct.Struct(">BBIdH")  # version, kind, seq, capture time, item count
+LINE = struct.Struct(">hhh")  # line center x, y, steering error
+TIMING = struct.Struct(">III")  # server wait, decode, detect time in microseconds
+PATH = struct.Struct(">ff")  # line heading (radians, + = bends right ahead), curvature (1/px)
+RAW = struct.Struct(">HH")  # width, height ahead of packed 8-bit pixels ("raw_roi" frames)
+
+KIND_OBJECTS = 1
+KIND_LINE = 2
+KIND_TRACKS = 3
+KIND_PATH = 4
+
+# Frame flags. FLAG_REPEAT: the Pi skipped a near-duplicate frame; the payload
+# is empty and the server should answer with its last detections.
+FLAG_REPEAT = 0x01
+
+# Label order for binary object boxes (must match OBJDET COLOR_RANGES)
+COLOR_NAMES = ("red", "orange", "yellow", "green", "blue", "violet")
+
+
+def encode_hello(config):
+    """Opening message of a tagged frame stream; config is a JSON-able dict."""
+    payload = json.dumps(config).encode()
+    return HELLO_MAGIC + SIZE.pack(len(payload)) + payload
+
+
+async def read_hello(reader):
+    """Read a hello from the start of a stream.
+
+    Returns the hello dict, or None if the stream does not start with one
+    (including when it closes first).
+    """
+    try:
+        if await reader.readexactly(len(HELLO_MAGIC)) != HELLO_MAGIC:
+            return None
+        (size,) = SIZE.unpack(await reader.readexactly(SIZE.size))
+        return json.loads((await reader.readexactly(size)).decode())
+    except asyncio.IncompleteReadError:
+        return None
+
+
+def encode_frame_header(seq, capture_time, size, flags=0):
+    return FRAME.pack(PROTOCOL_VERSION, flags, seq, capture_time, size)
+
+
+def _framed(payload):
+    return SIZE.pack(len(payload)) + payload
+
+
+def _timing(timings):
+    if not timings:
+        return b""
+    return TIMING.pack(*(min(0xFFFFFFFF, int(t * 1e6)) for t in timings))
+
+
+def encode_objects(seq, capture_time, colors, binary=True, timings=None, tracks=None):
+    """Length-prefixed detection message for {color: [(x, y, w, h), ...]}.
+
+    timings is an optional (wait, decode, detect) tuple in seconds. tracks,
+    if given, is [(track id, color, (x, y, w, h))] covering every detection;
+    binary messages then carry the tracks instead of plain boxes.
+    """
+    if not binary:
+        obj_found = [box for boxes in colors.values() for box in boxes]
+        message = {
+            "seq": seq,
+            "capture_time": capture_time,
+            "objects": obj_found,
+            "colors": colors,
+            "timings": timings,
+        }
+        if tracks is not None:
+            message["tracks"] = [{"id": i, "color": c, "box": box} for i, c, box in tracks]
+        return _framed(json.dumps(message).encode())
+
+    if tracks is not None:
+        items = []
+        for track_id, color, box in tracks:
+            label = COLOR_NAMES.index(color) if color in COLOR_NAMES else -1
+            items.extend((label, track_id & 0x7FFF, *box))
+        body = struct.pack(f">{len(items)}h", *items)
+        header = MESSAGE.pack(PROTOCOL_VERSION, KIND_TRACKS, seq, capture_time, len(tracks))
+        return _framed(header + body + _timing(timings))
+
+    items = []
+    for color, boxes in colors.items():
+        label = COLOR_NAMES.index(color) if color in COLOR_NAMES else -1
+        for box in boxes:
+            items.extend((label, *box))
+    count = len(items) // 5
+    body = struct.pack(f">{len(items)}h", *items)
+    header = MESSAGE.pack(PROTOCOL_VERSION, KIND_OBJECTS, seq, capture_time, count)
+    return _framed(header + body + _timing(timings))
+
+
+def encode_line(seq, capture_time, line_center, error, binary=True, timings=None, path=None):
+    """Length-prefixed line-following message.
+
+    path is an optional (row centers, heading, curvature) from the scanline
+    engine, row centers as [(x, y)] nearest first.
+    """
+    if not binary:
+        message = {
+            "seq": seq,
+            "capture_time": capture_time,
+            "line_center": line_center,
+            "error": error,
+            "timings": timings,
+        }
+        if path is not None:
+            message["points"], message["heading"], message["curvature"] = path
+        return _framed(json.dumps(message).encode())
+
+    if line_center is not None and path is not None:
+        points, heading, curvature = path
+        header = MESSAGE.pack(PROTOCOL_VERSION, KIND_PATH, seq, capture_time, len(points))
+        body = LINE.pack(line_center[0], line_center[1], error) + PATH.pack(heading, curvature)
+        body += struct.pack(f">{len(points) * 2}h", *(v for point in points for v in point))
+        return _framed(header + body + _timing(timings))
+    if line_center is None:
+        header = MESSAGE.pack(PROTOCOL_VERSION, KIND_LINE, seq, capture_time, 0)
+        return _framed(header + _timing(timings))
+    header = MESSAGE.pack(PROTOCOL_VERSION, KIND_LINE, seq, capture_time, 1)
+    body = LINE.pack(line_center[0], line_center[1], error)
+    return _framed(header + body + _timing(timings))
+
+
+def decode_message(payload):
+    """Decode a control channel payload (binary or JSON) into a dict."""
+    if payload[:1] == b"{":
+        return json.loads(payload.decode())
+
+    version, kind, seq, capture_time, count = MESSAGE.unpack_from(payload)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported protocol version {version}")
+    data = {"seq": seq, "capture_time": capture_time}
+    offset = MESSAGE.size
+
+    if kind == KIND_OBJECTS:
+        values = struct.unpack_from(f">{count * 5}h", payload, offset)
+        offset += count * 10
+        colors = {}
+        obj_found = []
+        for i in range(0, len(values), 5):
+            label, box = values[i], values[i + 1:i + 5]
+            name = COLOR_NAMES[label] if 0 <= label < len(COLOR_NAMES) else "unknown"
+            colors.setdefault(name, []).append(box)
+            obj_found.append(box)
+        data["objects"] = obj_found
+        data["colors"] = colors
+    elif kind == KIND_TRACKS:
+        values = struct.unpack_from(f">{count * 6}h", payload, offset)
+        offset += count * 12
+        colors = {}
+        tracks = []
+        for i in range(0, len(values), 6):
+            label, track_id, box = values[i], values[i + 1], values[i + 2:i + 6]
+            name = COLOR_NAMES[label] if 0 <= label < len(COLOR_NAMES) else "unknown"
+            colors.setdefault(name, []).append(box)
+            tracks.append({"id": track_id, "color": name, "box": box})
+        data["objects"] = [t["box"] for t in tracks]
+        data["colors"] = colors
+        data["tracks"] = tracks
+    elif kind == KIND_PATH:
+        cx, cy, error = LINE.unpack_from(payload, offset)
+        offset += LINE.size
+        heading, curvature = PATH.unpack_from(payload, offset)
+        offset += PATH.size
+        values = struct.unpack_from(f">{count * 2}h", payload, offset)
+        offset += count * 4
+        data["line_center"] = (cx, cy)
+        data["error"] = error
+        data["heading"] = heading
+        data["curvature"] = curvature
+        data["points"] = [values[i:i + 2] for i in range(0, len(values), 2)]
+    elif kind == KIND_LINE:
+        data["line_center"] = None
+        data["error"] = None
+        if count:
+            cx, cy, error = LINE.unpack_from(payload, offset)
+            offset += LINE.size
+            data["line_center"] = (cx, cy)
+            data["error"] = error
+    else:
+        raise ValueError(f"Unknown message kind {kind}")
+
+    if len(payload) - offset >= TIMING.size:
+        data["timings"] = tuple(t / 1e6 for t in TIMING.unpack_from(payload, offset))
+    return data
+
+
+async def read_message(reader):
+    """Read one length-prefixed control message and decode it."""
+    (msg_len,) = SIZE.unpack(await reader.readexactly(SIZE.size))
+    return decode_message(await reader.readexactly(msg_len))
@@ -0,0 +1,212 @@
+"""Record frame streams and replay them without a robot.
+
+A recording is two append-only files:
+  <name>.ptrec      REC_MAGIC + >I size + JSON hello, then raw frame payloads back to back
+  <name>.ptrec.idx  one INDEX entry per frame (offset, size, seq, flags,
+                    Pi capture time, local receive time)
+
+The servers record every frame they receive (before stale frames are
+dropped) when RECORD_DIR is set. Replay memory-maps the recording and pushes
+it into a running server's FRAME_PORT at the original pace or as fast as
+possible:
+
+    python -m Tools.recording recordings/10.0.21.5-3fa2c1d0-1700000000123456789.ptrec --fast
+
+Recordings are named after the client's session key (see session.py) and
+the time in nanoseconds, so sessions sharing an IP never share a file.
+"""
+import argparse
+import asyncio
+import json
+import mmap
+import os
+import struct
+import time
+from collections import namedtuple
+
+from Tools.latency import LatencyStats, record_reply, remember_sent
+from Tools.protocol import SIZE, encode_hello, encode_frame_header, read_message
+from Tools.session import session_key
+
+REC_MAGIC = b"PTRC"
+INDEX = struct.Struct(">QIIBdd")  # offset, size, seq, flags, capture time, received time
+# After the last frame, wait until no reply came for REPLY_IDLE seconds (at most REPLY_TIMEOUT)
+REPLY_IDLE = 0.5
+REPLY_TIMEOUT = 10.0
+
+IndexEntry = namedtuple("IndexEntry", "offset size seq flags capture_time received")
+
+
+class Recorder:
+    """Appends received frames to a recording."""
+
+    def __init__(self, path=None, directory=None, ip=None):
+        self.path = path
+        self.directory = directory
+        self.ip = ip
+        self.data = None
+        self.index = None
+        self.frames = 0
+
+    @classmethod
+    def for_client(cls, directory, ip):
+        """A recorder in directory, named once the client's hello says its session."""
+        return cls(directory=directory, ip=ip)
+
+    def start(self, hello):
+        """Open the files and write the header; hello is the client's hello dict."""
+        if self.path is None:
+            os.makedirs(self.directory, exist_ok=True)
+            key = session_key(hello, self.ip).replace("/", "-")
+            self.path = os.path.join(self.directory, f"{key}-{time.time_ns()}.ptrec")
+        payload = json.dumps(hello).encode()
+        # "x": a name collision fails instead of overwriting another recording
+        self.data = open(self.path, "xb")
+        self.index = open(self.path + ".idx", "xb")
+        self.data.write(REC_MAGIC + SIZE.pack(len(payload)) + payload)
+        print(f"[RECORD] Recording frames to {self.path}")
+
+    def write(self, frame):
+        """Append one ingest Frame."""
+        offset = self.data.tell()
+        self.data.write(frame.data)
+        self.index.write(INDEX.pack(offset, len(frame.data), frame.seq, frame.flags,
+                                    frame.capture_time, frame.received))
+        self.frames += 1
+
+    def close(self):
+        for f in (self.data, self.index):
+            if f is not None:
+                f.close()
+        if self.data is not None:
+            print(f"[RECORD] Saved {self.frames} frames to {self.path}")
+
+
+class Recording:
+    """Read-only, memory-mapped view of a recording."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path + ".idx", "rb") as f:
+            raw = f.read()
+        # A crash can leave a half-written last entry; ignore it
+        raw = raw[:len(raw) - len(raw) % INDEX.size]
+        self.entries = [IndexEntry(*e) for e in INDEX.iter_unpack(raw)]
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(REC_MAGIC)] != REC_MAGIC:
+            raise ValueError(f"{path} is not a frame recording")
+        (size,) = SIZE.unpack_from(self.map, len(REC_MAGIC))
+        start = len(REC_MAGIC) + SIZE.size
+        self.hello = json.loads(bytes(self.map[start:start + size]).decode())
+        self.view = memoryview(self.map)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def payload(self, entry):
+        """Frame bytes for an index entry, without copying them out of the map."""
+        return self.view[entry.offset:entry.offset + entry.size]
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+
+async def count_replies(reader, stats, sent_times, counter):
+    """Record reply round trips; counter holds [replies, time of the last one]."""
+    try:
+        while True:
+            data = await read_message(reader)
+            record_reply(stats, data, sent_times)
+            counter[0] += 1
+            counter[1] = time.monotonic()
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        pass
+
+
+async def replay(path, host="127.0.0.1", frame_port=11000, control_port=11001, speed=1.0):
+    """Push a recording into a running detection server.
+
+    speed scales the original frame timing (2.0 = twice as fast); 0 sends as
+    fast as the connection allows. Frames get fresh capture times so the
+    reply round trips are measured against this machine's clock. The
+    detection throughput reported is replies per second: at speed 0 the
+    server drops whatever it has no time for, so the send rate says little.
+    """
+    recording = Recording(path)
+    stats = LatencyStats("REPLAY")
+    sent_times = {}
+    replies = [0, None]
+
+    _, writer_f = await asyncio.open_connection(host, frame_port)
+    reader_c, writer_c = None, None
+    if control_port:
+        reader_c, writer_c = await asyncio.open_connection(host, control_port)
+    listener = asyncio.create_task(count_replies(reader_c, stats, sent_times, replies)) if reader_c else None
+
+    hello = dict(recording.hello)
+    hello.setdefault("protocol", "binary")
+    if writer_c is not None and hello.get("session"):
+        # The server sends a session's replies to the control channel with the same session
+        writer_c.write(encode_hello({"session": hello["session"]}))
+        await writer_c.drain()
+    writer_f.write(encode_hello(hello))
+    print(f"[REPLAY] Sending {len(recording)} frames from {path}")
+
+    start = time.monotonic()
+    first = recording.entries[0].received if recording.entries else 0.0
+    try:
+        for seq, entry in enumerate(recording.entries):
+            if speed > 0:
+                due = start + (entry.received - first) / speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            writer_f.write(encode_frame_header(seq, time.monotonic(), entry.size, entry.flags))
+            writer_f.write(recording.payload(entry))
+            await writer_f.drain()
+            remember_sent(sent_times, seq, time.monotonic())
+        elapsed = time.monotonic() - start
+        # Let the server work through what it still has queued
+        deadline = time.monotonic() + REPLY_TIMEOUT
+        while listener is not None and not listener.done() and time.monotonic() < deadline:
+            if time.monotonic() - max(replies[1] or 0.0, start + elapsed) > REPLY_IDLE:
+                break
+            await asyncio.sleep(0.05)
+    finally:
+        writer_f.close()
+        if writer_c is not None:
+            writer_c.close()
+        if listener is not None:
+            listener.cancel()
+        recording.close()
+
+    fps = len(recording) / elapsed if elapsed > 0 else 0.0
+    print(f"[REPLAY] Sent {len(recording)} frames in {elapsed:.2f} s ({fps:.1f} frames/s)")
+    # The server drops frames it has no time for, so throughput is what it answered
+    if replies[0]:
+        answered = replies[1] - start
+        rate = replies[0] / answered if answered > 0 else 0.0
+        print(f"[REPLAY] Received {replies[0]} replies in {answered:.2f} s ({rate:.1f} replies/s)")
+    else:
+        print("[REPLAY] Received 0 replies")
+    if stats.samples:
+        print(stats.report())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded frame stream into a detection server.")
+    parser.add_argument("path", help="recording (.ptrec) to replay")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--frame-port", type=int, default=11000)
+    parser.add_argument("--control-port", type=int, default=11001, help="0 to skip the control channel")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed factor (default: original pace)")
+    parser.add_argument("--fast", action="store_true", help="send as fast as possible")
+    args = parser.parse_args()
+    asyncio.run(replay(args.path, args.host, args.frame_port, args.control_port, 0 if args.fast else args.speed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+"""Pipelined camera -> JPEG -> socket sender for the Pi-Top clients.
+
+Capture runs in its own thread, JPEG encoding in a small worker pool and
+the network writer on the event loop, so the Pi's cores overlap the three
+stages instead of running them back to back. Each stage hands over only
+its newest result, and a Pacer holding TARGET_FPS replaces the fixed
+sleeps between frames. With a BitrateController attached, quality,
+resolution and frame rate follow the controller instead. With a ChangeGate
+attached, near-duplicate frames are not encoded at all and go out as
+empty FLAG_REPEAT frames. With a FlightWindow attached, only a limited
+number of frames may be waiting for their reply at once; the writer then
+takes the newest frame once a slot frees up, and everything encoded in the
+meantime is dropped on the Pi instead of queueing on the link.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from Tools.ingest import FrameQueue
+from Tools.latency import remember_sent
+from Tools.protocol import encode_hello, encode_frame_header, FLAG_REPEAT
+from Tools.startup import lazy_import, mark
+
+# Loaded on first use, so the Pi tools start connecting sooner (see startup.py)
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+
+TARGET_FPS = 30
+JPEG_QUALITY = 80
+# cv2.imencode releases the GIL, so encoder threads really run in parallel
+ENCODE_WORKERS = 2
+
+# Change gate: the thumbnail is split into CHANGE_BLOCK x CHANGE_BLOCK pixel
+# blocks, and a frame counts as changed when any block's mean absolute
+# difference (0-255) passes CHANGE_THRESHOLD. Judging the most-changed block
+# rather than the whole frame catches a small moving object. Also the
+# thumbnail subsampling step, and the longest time between full frames so
+# the stream never goes silent
+CHANGE_THRESHOLD = 12.0
+CHANGE_BLOCK = 4
+THUMBNAIL_STEP = 8
+KEYFRAME_INTERVAL = 1.0
+
+# Flight window: bounds on frames sent but not yet answered, how long an
+# unanswered frame holds its slot, and how many reply round trips the window
+# size is based on
+MIN_WINDOW = 1
+MAX_WINDOW = 8
+WINDOW_TIMEOUT = 1.0
+RTT_SAMPLES = 30
+
+
+class Pacer:
+    """Hands out sleeps that hold a steady rate, without trying to catch up."""
+
+    def __init__(self, fps=TARGET_FPS):
+        self.fps = fps
+        self.next = time.monotonic()
+
+    def delay(self):
+        """Seconds to wait before the next tick."""
+        now = time.monotonic()
+        delay = max(0.0, self.next - now)
+        # If we fell behind, restart the schedule from now
+        self.next = max(self.next, now) + 1.0 / self.fps
+        return delay
+
+    def wait(self):
+        time.sleep(self.delay())
+
+    async def wait_async(self):
+        await asyncio.sleep(self.delay())
+
+
+class ChangeGate:
+    """Decides whether a frame differs enough from the last one sent to be worth sending."""
+
+    def __init__(self, threshold=CHANGE_THRESHOLD, keyframe_interval=KEYFRAME_INTERVAL,
+                 step=THUMBNAIL_STEP, block=CHANGE_BLOCK):
+        self.threshold = threshold
+        self.keyframe_interval = keyframe_interval
+        self.step = step
+        self.block = block
+        self.last_thumbnail = None
+        self.last_sent = 0.0
+        self.skipped = 0
+
+    def check(self, frame, now=None):
+        """The frame's thumbnail if it should be sent, else None.
+
+        Nothing is remembered: pass the thumbnail to commit() once the frame
+        has actually gone out, so a frame dropped on the way is not taken as sent.
+        """
+        if now is None:
+            now = time.monotonic()
+        thumbnail = np.asarray(frame)[::self.step, ::self.step].astype(np.int16)
+        if (self.last_thumbnail is None
+                or self.last_thumbnail.shape != thumbnail.shape
+                or now - self.last_sent >= self.keyframe_interval
+                or self.block_difference(thumbnail) > self.threshold):
+            return thumbnail
+        self.skipped += 1
+        return None
+
+    def block_difference(self, thumbnail):
+        """Largest mean absolute difference of any block against the last thumbnail sent."""
+        diff = np.abs(thumbnail - self.last_thumbnail)
+        if diff.ndim == 3:
+            diff = diff.mean(axis=2)
+        b = self.block
+        # Edge blocks are padded with their own values so they count in full
+        diff = np.pad(diff, ((0, -diff.shape[0] % b), (0, -diff.shape[1] % b)), mode="edge")
+        rows, cols = diff.shape[0] // b, diff.shape[1] // b
+        return float(diff.reshape(rows, b, cols, b).mean(axis=(1, 3)).max())
+
+    def commit(self, thumbnail, now):
+        """Remember a frame from check() as the last one sent."""
+        self.last_thumbnail = thumbnail
+        self.last_sent = now
+
+    def changed(self, frame, now=None):
+        """Return True (and remember the frame) if it should be sent."""
+        if now is None:
+            now = time.monotonic()
+        thumbnail = self.check(frame, now)
+        if thumbnail is None:
+            return False
+        self.commit(thumbnail, now)
+        return True
+
+
+def encode_jpeg(rgb, quality, scale=1.0):
+    """Convert an RGB camera frame to BGR, downscale it and JPEG-encode it.
+
+    Returns the JPEG bytes, or None if encoding failed.
+    """
+    frame = cv2.cvtColor(np.asarray(rgb), cv2.COLOR_RGB2BGR)
+    if scale < 1.0:
+        frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    ok, jpeg = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    return jpeg.tobytes() if ok else None
+
+
+class FlightWindow:
+    """Limits frames in flight to what the link's round trip needs.
+
+    Frames are registered by seq when sent and leave the window when their
+    reply comes back. Replies are cumulative: the server drops stale frames
+    without answering them, so a reply also clears every older frame. A
+    frame that gets no reply frees its slot after WINDOW_TIMEOUT. The size
+    follows the bandwidth-delay product: the lowest recent send -> reply
+    round trip times the frame rate, plus one. The lowest rather than the
+    typical round trip keeps queueing delay from growing the window. Until
+    the first reply arrives the window stays open.
+    """
+
+    def __init__(self, fps=TARGET_FPS, min_size=MIN_WINDOW, max_size=MAX_WINDOW,
+                 timeout=WINDOW_TIMEOUT, name="STREAM"):
+        self.fps = fps
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.name = name
+        self.size = max_size
+        self.in_flight = {}  # seq -> time it finished sending
+        self.rtts = deque(maxlen=RTT_SAMPLES)
+        self.freed = None  # asyncio.Event, made on first use inside the running loop
+        self.expired = 0
+
+    def expire(self, now):
+        for seq, sent in list(self.in_flight.items()):
+            if now - sent > self.timeout:
+                del self.in_flight[seq]
+                self.expired += 1
+
+    async def acquire(self):
+        """Wait until another frame may be sent."""
+        while self.rtts:
+            now = time.monotonic()
+            self.expire(now)
+            if len(self.in_flight) < self.size:
+                return
+            if self.freed is None:
+                self.freed = asyncio.Event()
+            self.freed.clear()
+            oldest = min(self.in_flight.values())
+            try:
+                await asyncio.wait_for(self.freed.wait(), self.timeout - (now - oldest))
+            except asyncio.TimeoutError:
+                pass
+
+    def sent(self, seq, now):
+        self.in_flight[seq] = now
+
+    def ack(self, seq, now=None):
+        """Match a reply to its frame. Returns the round trip, or None if the frame was not in flight."""
+        sent = self.in_flight.get(seq)
+        if sent is None:
+            return None
+        if now is None:
+            now = time.monotonic()
+        for old in [s for s in self.in_flight if s <= seq]:
+            del self.in_flight[old]
+        rtt = now - sent
+        self.rtts.append(rtt)
+        self.resize()
+        if self.freed is not None:
+            self.freed.set()
+        return rtt
+
+    def resize(self):
+        size = math.ceil(min(self.rtts) * self.fps) + 1
+        size = max(self.min_size, min(self.max_size, size))
+        if size != self.size:
+            print(f"[WINDOW {self.name}] {size} frames in flight "
+                  f"(round trip {min(self.rtts) * 1000:.0f} ms at {self.fps} fps)")
+            self.size = size
+
+
+class FrameSender:
+    """Streams camera frames as a tagged frame stream (see Tools.protocol).
+
+    camera only needs a get_frame() method returning an RGB image, and
+    encoder(rgb, quality, scale) turns one into payload bytes (or None).
+    When a controller is given it overrides fps and quality, and is fed drain times.
+    When a gate is given, unchanged frames are sent as empty FLAG_REPEAT frames.
+    When a window is given, the caller passes replies to window.ack().
+    Downscaled frames are still reported at full size through the hello's
+    "frame_size", so servers can map detections back.
+    """
+
+    def __init__(self, camera, writer, hello, fps=TARGET_FPS, quality=JPEG_QUALITY,
+                 workers=ENCODE_WORKERS, stats=None, sent_times=None, controller=None,
+                 encoder=encode_jpeg, gate=None, window=None):
+        self.camera = camera
+        self.encoder = encoder
+        self.gate = gate
+        self.writer = writer
+        self.hello = hello
+        self.pacer = Pacer(fps)
+        self.quality = quality
+        self.workers = workers
+        self.stats = stats
+        self.sent_times = sent_times if sent_times is not None else {}
+        self.controller = controller
+        self.window = window
+        self.running = False
+        self.newest_encoded = -1
+
+    def capture_loop(self, loop, captured):
+        """Capture thread: grab frames at the paced rate and hand them to the loop."""
+        seq = 0
+        while self.running:
+            if self.controller is not None:
+                self.pacer.fps = self.controller.fps
+            self.pacer.wait()
+            start = time.monotonic()
+            rgb = self.camera.get_frame()
+            capture_time = time.monotonic()
+            item = (seq, capture_time, rgb, None)
+            if self.gate is not None:
+                # Compared against the last frame actually sent; send_loop commits
+                # the thumbnail after writing, so until then changed frames keep
+                # coming through as real frames instead of repeats
+                rgb = np.asarray(rgb)
+                thumbnail = self.gate.check(rgb, capture_time)
+                item = (seq, capture_time, None if thumbnail is None else rgb, thumbnail)
+            try:
+                if self.stats is not None:
+                    loop.call_soon_threadsafe(self.stats.record, "capture", capture_time - start)
+                loop.call_soon_threadsafe(captured.put, item)
+            except RuntimeError:
+                return  # event loop already closed
+            seq += 1
+
+    async def encode_one(self, pool, slots, seq, capture_time, rgb, thumbnail, encoded):
+        if rgb is None:
+            # Skipped by the change gate: nothing to encode
+            if seq > self.newest_encoded:
+                self.newest_encoded = seq
+                encoded.put((seq, capture_time, b"", FLAG_REPEAT, None))
+            slots.release()
+            return
+        try:
+            quality, scale = self.quality, 1.0
+            if self.controller is not None:
+                quality, scale = self.controller.quality, self.controller.scale
+            start = time.monotonic()
+            data = await asyncio.get_running_loop().run_in_executor(pool, self.encoder, rgb, quality, scale)
+            if self.stats is not None:
+                self.stats.record("encode", time.monotonic() - start)
+            # Encoders can finish out of order; never replace a newer frame
+            if data is not None and seq > self.newest_encoded:
+                self.newest_encoded = seq
+                encoded.put((seq, capture_time, data, 0, thumbnail))
+        finally:
+            slots.release()
+
+    async def encode_loop(self, pool, captured, encoded):
+        """Keep every encoder busy with the newest captured frame."""
+        slots = asyncio.Semaphore(self.workers)
+        tasks = set()
+        while True:
+            await slots.acquire()
+            item = await captured.get()
+            if item is None:
+                slots.release()
+                return
+            task = asyncio.create_task(self.encode_one(pool, slots, *item, encoded))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    async def send_loop(self, encoded):
+        """Write the newest encoded frame as soon as the socket is free."""
+        while True:
+            if self.window is not None:
+                self.window.fps = self.pacer.fps
+                await self.window.acquire()
+            item = await encoded.get()
+            if item is None:
+                return
+            seq, capture_time, data, flags, thumbnail = item
+            start = time.monotonic()
+            self.writer.write(encode_frame_header(seq, capture_time, len(data), flags) + data)
+            await self.writer.drain()
+            sent = time.monotonic()
+            if thumbnail is not None:
+                self.gate.commit(thumbnail, capture_time)
+            remember_sent(self.sent_times, seq, sent)
+            mark("first frame sent")
+            if self.window is not None:
+                self.window.sent(seq, sent)
+            if self.stats is not None:
+                self.stats.record("send", sent - start)
+            if self.controller is not None:
+                self.controller.observe_drain(sent - start)
+
+    async def run(self):
+        """Stream until the connection drops or the task is cancelled."""
+        loop = asyncio.get_running_loop()
+        captured = FrameQueue(1)
+        encoded = FrameQueue(1)
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        self.running = True
+        capture = threading.Thread(target=self.capture_loop, args=(loop, captured), daemon=True)
+        encoder = asyncio.create_task(self.encode_loop(pool, captured, encoded))
+        try:
+            self.writer.write(encode_hello(self.hello))
+            capture.start()
+            await self.send_loop(encoded)
+        finally:
+            self.running = False
+            encoder.cancel()
+            pool.shutdown(wait=False)
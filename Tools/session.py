@@ -0,0 +1,91 @@
+"""Per-robot sessions for the computer-side detection servers.
+
+Each Pi client picks a random session ID and sends it in the hello on both
+of its connections, so the frame and control channels of one robot find
+each other even when several robots share an IP (NAT, or several clients on
+one machine). Legacy clients without a session ID are keyed by IP as before.
+
+All sessions share one worker pool through a FairScheduler, which hands
+free workers to sessions in round-robin order so a fast robot cannot starve
+the others.
+"""
+import asyncio
+import secrets
+from collections import OrderedDict, deque
+
+
+def new_session_id():
+    return secrets.token_hex(4)
+
+
+def session_key(hello, ip):
+    """Key for a client's session: IP plus its session ID, or just the IP for legacy clients."""
+    session = (hello or {}).get("session")
+    return f"{ip}/{session}" if session else ip
+
+
+class FairScheduler:
+    """Runs jobs on a shared executor, taking turns between sessions.
+
+    At most `slots` jobs are inside the executor at once; the rest wait in
+    per-session queues. Whenever a worker frees up, the next session in
+    round-robin order with work waiting gets it. A session keeps at most
+    `depth` jobs waiting: a newer job cancels its oldest waiting one, so a
+    worker always gets a session's newest frame, not a stale one.
+    """
+
+    def __init__(self, executor, slots, depth=1):
+        self.executor = executor
+        self.slots = slots
+        self.depth = depth
+        self.busy = 0
+        self.queues = OrderedDict()  # session key -> deque of (future, func, args)
+
+    def submit(self, key, func, *args):
+        """Queue func(*args) for a session; returns an asyncio future for its result."""
+        future = asyncio.get_running_loop().create_future()
+        queue = self.queues.setdefault(key, deque())
+        while len(queue) >= self.depth:
+            queue.popleft()[0].cancel()  # superseded by the newer job
+        queue.append((future, func, args))
+        self.dispatch()
+        return future
+
+    def forget(self, key):
+        """Drop a session's waiting jobs (jobs already running still finish)."""
+        for future, _, _ in self.queues.pop(key, ()):
+            future.cancel()
+
+    def next_job(self):
+        for key in list(self.queues):
+            queue = self.queues[key]
+            # Whoever is served goes to the back of the line
+            self.queues.move_to_end(key)
+            while queue:
+                job = queue.popleft()
+                if not job[0].cancelled():
+                    return job
+        return None
+
+    def dispatch(self):
+        loop = asyncio.get_running_loop()
+        while self.busy < self.slots:
+            job = self.next_job()
+            if job is None:
+                return
+            future, func, args = job
+            self.busy += 1
+            running = loop.run_in_executor(self.executor, func, *args)
+            running.add_done_callback(lambda done, future=future: self.finished(done, future))
+
+    def finished(self, done, future):
+        self.busy -= 1
+        if done.cancelled():
+            future.cancel()
+        elif future.cancelled():
+            pass  # the session went away while its job ran
+        elif done.exception() is not None:
+            future.set_exception(done.exception())
+        else:
+            future.set_result(done.result())
+        self.dispatch()
@@ -0,0 +1,135 @@
+"""Deferred imports and devices for fast Pi-side startup.
+
+main.py starts every Pi tool in a fresh `python3 -c`, so whatever a tool
+imports or opens at module level delays its first frame. Tools therefore
+bind heavy libraries with lazy_import() and hardware with LazyDevice: both
+only load on first use. The time that is left can be overlapped with
+connecting to the server via preload() (import in a background thread)
+and LazyDevice.warm() (open the device in a background thread).
+
+Set PITOP_STARTUP_PROFILE=1 (main.py passes it on to the Pi) to print how
+long each deferred import and device init took, plus startup milestones
+such as the first frame sent, measured from process launch. In a process
+that runs tools again and again (Tools/agent.py), restart() makes them
+measured from the start of each run instead.
+"""
+import importlib
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+PROFILE = os.environ.get("PITOP_STARTUP_PROFILE") == "1"
+
+IMPORTED = time.monotonic()
+marked = set()
+run_started = None  # set by restart()
+
+
+def restart():
+    """Profile a new tool run in this process: milestones are measured and printed afresh."""
+    global run_started
+    run_started = time.monotonic()
+    marked.clear()
+
+
+def since_launch():
+    """Seconds since this run (restart()) or else this process started.
+
+    Falls back to since this module loaded if /proc is unavailable.
+    """
+    if run_started is not None:
+        return time.monotonic() - run_started
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the ")" closing the command name; starttime is field 22
+            started = int(f.read().rsplit(")", 1)[1].split()[19]) / os.sysconf("SC_CLK_TCK")
+        with open("/proc/uptime") as f:
+            return float(f.read().split()[0]) - started
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - IMPORTED
+
+
+@contextmanager
+def timed(label):
+    """Time a block and print it when profiling."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        if PROFILE:
+            print(f"[STARTUP] {label}: {(time.monotonic() - start) * 1000:.0f} ms "
+                  f"(done {since_launch():.2f} s after launch)")
+
+
+def mark(label):
+    """Print a startup milestone the first time it is reached (when profiling)."""
+    if PROFILE and label not in marked:
+        marked.add(label)
+        print(f"[STARTUP] {label} {since_launch():.2f} s after launch")
+
+
+class LazyModule:
+    """Stands in for a module until one of its attributes is used."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            with timed(f"import {self._name}"):
+                self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        value = getattr(self._load(), attr)
+        setattr(self, attr, value)  # later lookups skip __getattr__
+        return value
+
+
+def lazy_import(name):
+    """The module if it is already imported, else a LazyModule for it."""
+    return sys.modules.get(name) or LazyModule(name)
+
+
+def preload(*names):
+    """Import modules in a background thread, e.g. while connecting (missing ones are skipped)."""
+    def load():
+        for name in names:
+            if name not in sys.modules:
+                try:
+                    with timed(f"import {name} (preload)"):
+                        importlib.import_module(name)
+                except ImportError:
+                    pass  # whoever uses it first gets the error
+    threading.Thread(target=load, name="preload", daemon=True).start()
+
+
+class LazyDevice:
+    """Creates a device with factory() on first use and forwards everything to it."""
+
+    def __init__(self, factory, label):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_label", label)
+        object.__setattr__(self, "_device", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def get(self):
+        if self._device is None:
+            with self._lock:
+                if self._device is None:
+                    with timed(f"init {self._label}"):
+                        object.__setattr__(self, "_device", self._factory())
+        return self._device
+
+    def warm(self):
+        """Start creating the device in the background."""
+        threading.Thread(target=self.get, name=f"warm {self._label}", daemon=True).start()
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.get(), name, value)
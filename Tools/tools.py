@@ -6,18 +6,24 @@ OBJDET - Object Detection: Basic object detection
 using color isolation, with main processing and 
 viewing via network.
 
+LNFOL - Line Following: Line detection on the computer,
+with a fixed-rate steering loop on the Pi-Top.
+
 RC - Remote Control: Control your Pi-Top remotely 
 via network.
 
 USM - Ultrasonic Measurement: Basic object avoidance
 using Pi-Top's ultrasonic sensor.
 
+BROKER - Hardware Broker: Owns the Pi-Top camera and
+ultrasonic sensor and shares them with the other tools.
+
 Each tool can be run asynchronously using the provided 
 functions.
 """
 
 import asyncio as aio
-import time
+from Tools.startup import timed
 
 # ===========================
 # OBJECT DETECTION FUNCTIONS
@@ -27,32 +33,69 @@ async def run_color_isoc():
     from Tools.OBJDET.computer import main as isocmain
     await isocmain()
 
-async def run_color_isos():
+async def run_color_isos(ip):
     """Object Detection - Color Isolation Server (Pi-Top side)"""
     try:
-        from Tools.OBJDET.pt import start_client as isosmain
-        return await isosmain()
+        with timed("import Tools.OBJDET.pt"):
+            from Tools.OBJDET.pt import start_client as isosmain
+        return await isosmain(ip)
     except ImportError:
         print("Pi-Top-specific dependencies missing. Run this on Pi-Top hardware.")
-        time.sleep(2)
+        await aio.sleep(2)
     except Exception as e:
         print(f"[run_color_isos] Error: {e}")
         return None
 
+# ===========================
+# LINE FOLLOWING FUNCTIONS
+# ===========================
+async def run_line_followc():
+    """Line Following - Line Detection Controller (Computer side)"""
+    from Tools.LNFOL.computer import main as lnfolcmain
+    await lnfolcmain()
+
+async def run_line_follows(ip):
+    """Line Following - Frame Streamer + Steering Loop (Pi-Top side)"""
+    try:
+        with timed("import Tools.LNFOL.pt"):
+            from Tools.LNFOL.pt import main as lnfolsmain
+        await lnfolsmain(ip)
+    except ImportError:
+        print("Pi-Top-specific dependencies missing. Run this on Pi-Top hardware.")
+        await aio.sleep(2)
+    except Exception as e:
+        print(f"[run_line_follows] Error: {e}")
+
 # ===========================
 # ULTRASONIC FUNCTIONS
 # ===========================
 async def run_ultrasonic():
     """Ultrasonic Measurement (Pi-Top side)"""
     try:
-        from Tools.USM.pt import main as ultrasonicmain
+        with timed("import Tools.USM.pt"):
+            from Tools.USM.pt import main as ultrasonicmain
         await ultrasonicmain()
     except ImportError:
         print("Pi-Top ultrasonic module not found. Run on Pi-Top hardware.")
-        time.sleep(2)
+        await aio.sleep(2)
     except Exception as e:
         print(f"[run_ultrasonic] Error: {e}")
 
+# ===========================
+# HARDWARE BROKER FUNCTIONS
+# ===========================
+async def run_broker():
+    """Hardware Broker - Camera + Sensor Sharing (Pi-Top side)"""
+    try:
+        with timed("import Tools.broker"):
+            from Tools.broker import main as brokermain
+        await aio.to_thread(brokermain)
+    except ImportError:
+        print("Pi-Top-specific dependencies missing. Run this on Pi-Top hardware.")
+        await aio.sleep(2)
+    except Exception as e:
+        print(f"[run_broker] Error: {e}")
+
 # ===========================
 # REMOTE CONTROL FUNCTIONS
 # ===========================
@@ -64,10 +107,11 @@ async def run_remote_control_client(ip):
 async def run_remote_control_server():
     """Remote Control - Server (Pi-Top side)"""
     try:
-        from Tools.RC.pt import main as rcmains
+        with timed("import Tools.RC.pt"):
+            from Tools.RC.pt import main as rcmains
         await rcmains()
     except ImportError:
         print("Pi-Top remote control module not found. Run on Pi-Top hardware.")
-        time.sleep(2)
+        await aio.sleep(2)
     except Exception as e:
         print(f"[run_remote_control_server] Error: {e}")
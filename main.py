@@ -1,11 +1,27 @@
 from Tools.tools import *
 import paramiko
 import asyncio
+import os
+import subprocess
+from Tools.agent import AgentClient, AGENT_PORT
 
-async def ssh_run_remote(function_name, host="100.87.152.13", username="root", password="pi-top", port=22):
+# Run the Pi-side tools through the warm agent (Tools/agent.py) instead of a
+# fresh git pull + python3 per launch; falls back to that if the agent can't start
+USE_AGENT = True
+AGENT_START_COMMAND = ('cd /root/repo && git stash && git pull && '
+                       'PYTHONPATH=/root/repo nohup python3 -u -m Tools.agent '
+                       '> /tmp/pitop-agent.log 2>&1 &')
+# PITOP_STARTUP_PROFILE=1 python main.py also profiles the Pi side's startup
+# (import and device init times, time to first frame; see Tools/startup.py)
+STARTUP_PROFILE = os.environ.get("PITOP_STARTUP_PROFILE") == "1"
+# Seconds to wait for the SSH connection or an agent reply before giving up
+AGENT_TIMEOUT = 10.0
+
+async def ssh_run_remote(function_name, *args, host="100.87.152.13", username="root", password="pi-top", port=22):
     """
-    SSH into a remote machine, run a Python async function,
-    and keep streaming output until the function ends or is interrupted.
+    SSH into a remote machine, run a Python async function (with optional
+    string/number args), and keep streaming output until the function ends
+    or is interrupted.
     """
     print(f"[SSH] Connecting to {host}...")
     client = paramiko.SSHClient()
@@ -22,10 +38,11 @@ async def ssh_run_remote(function_name, host="100.87.152.13", username="root", p
     command = (
         'cd /root/repo && '
         'git stash && git pull && '
+        + ('PITOP_STARTUP_PROFILE=1 ' if STARTUP_PROFILE else '') +
         'PYTHONPATH=/root/repo python3 -u -c '
         f'"from Tools.tools import {function_name}; '
         'import asyncio; '
-        f'asyncio.run({function_name}())"'
+        f'asyncio.run({function_name}({", ".join(repr(a) for a in args)}))"'
     )
 
     transport = client.get_transport()
@@ -64,7 +81,136 @@ async def ssh_run_remote(function_name, host="100.87.152.13", username="root", p
         print("[SSH] Session closed.")
 
 
+async def open_agent(client, attempts=10):
+    """Tunnel to the Pi's agent over the SSH connection, starting the agent if it isn't running.
+
+    The paramiko calls run in worker threads: other tools may be serving on this event loop.
+    """
+    transport = client.get_transport()
+    for attempt in range(attempts):
+        try:
+            channel = await asyncio.to_thread(transport.open_channel, "direct-tcpip", ("127.0.0.1", AGENT_PORT),
+                                              ("127.0.0.1", 0), timeout=AGENT_TIMEOUT)
+            channel.settimeout(AGENT_TIMEOUT)
+            return AgentClient(channel)
+        except paramiko.ChannelException:
+            if attempt == 0:
+                print("[AGENT] Not running on the Pi, starting it...")
+                profile = 'PITOP_STARTUP_PROFILE=1 ' if STARTUP_PROFILE else ''
+                await asyncio.to_thread(client.exec_command, AGENT_START_COMMAND.replace("nohup ", profile + "nohup ", 1))
+            await asyncio.sleep(1)
+    return None
+
+def local_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def pushed(revision):
+    """True if revision is on a remote branch, so a git pull on the Pi can reach it."""
+    try:
+        return bool(subprocess.run(["git", "branch", "-r", "--contains", revision],
+                                   capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return True  # can't tell; let the Pi try
+
+async def agent_run_remote(function_name, *args, host="100.87.152.13", username="root", password="pi-top", port=22):
+    """
+    Run a Tools.tools function on the Pi through its warm agent and stream
+    its output until it ends or is interrupted. The Pi's code is only pulled
+    when its revision differs from this checkout's.
+    """
+    print(f"[SSH] Connecting to {host}...")
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    try:
+        await asyncio.to_thread(client.connect, host, port=port, username=username, password=password,
+                                timeout=AGENT_TIMEOUT)
+    except Exception as e:
+        print(f"[SSH] Connection failed: {e}")
+        return
+
+    agent = None
+    started = False
+    try:
+        agent = await open_agent(client)
+        if agent is None:
+            print("[AGENT] Unreachable, falling back to a direct launch")
+            client.close()
+            client = None
+            await ssh_run_remote(function_name, *args, host=host, username=username, password=password, port=port)
+            return
+
+        revision = await asyncio.to_thread(local_revision)
+        status = await agent.call_async("status")
+        if revision and status.get("revision") != revision:
+            # Only ask for a pull when it can bring the Pi to this revision
+            reply = None
+            if await asyncio.to_thread(pushed, revision):
+                reply = await agent.call_async("sync", revision=revision)
+            if reply is None:
+                print(f"[AGENT] Local checkout {revision[:8]} is not pushed; "
+                      f"the Pi runs {(status.get('revision') or 'unknown')[:8]}")
+            elif not reply["ok"]:
+                print(f"[AGENT] Sync failed: {reply['error']}")
+            elif not reply["synced"]:
+                print(f"[AGENT] Pi is at {(reply['revision'] or 'unknown')[:8]} after pulling, local checkout "
+                      f"is at {revision[:8]} (another branch?); running the Pi's code")
+            else:
+                print(f"[AGENT] Pi updated to {reply['revision'][:8]}, restarting agent...")
+                agent.close()
+                await asyncio.sleep(1)
+                agent = await open_agent(client)
+                if agent is None:
+                    print("[AGENT] Did not come back after the update")
+                    return
+
+        if function_name in (await agent.call_async("status"))["running"]:
+            await agent.call_async("stop", function=function_name)
+        since = (await agent.call_async("logs"))["next"]
+        reply = await agent.call_async("start", function=function_name, args=list(args))
+        if not reply["ok"]:
+            print(f"[AGENT] Could not start {function_name}: {reply['error']}")
+            return
+        started = True
+        print(f"[AGENT] {function_name}() running on the Pi. Streaming output...\n")
+
+        while True:
+            logs = await agent.call_async("logs", since=since)
+            since = logs["next"]
+            for line in logs["lines"]:
+                if line.strip():
+                    print("[REMOTE]", line.strip())
+            status = await agent.call_async("status")
+            if function_name not in status["running"]:
+                print(f"[AGENT] {function_name} {status['finished'].get(function_name, 'ended')}")
+                started = False
+                break
+            await asyncio.sleep(0.2)
+
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print("[AGENT] Interrupted by user. Stopping remote function...")
+        raise
+
+    except (ConnectionError, OSError, paramiko.SSHException) as e:
+        print(f"[AGENT] Connection lost: {e}")
+
+    finally:
+        if agent is not None:
+            try:
+                if started:
+                    await agent.call_async("stop", function=function_name)
+                agent.close()
+            except Exception:
+                pass
+        if client is not None:
+            client.close()
+        print("[SSH] Session closed.")
+
+
 async def main():
+    run_remote = agent_run_remote if USE_AGENT else ssh_run_remote
     try:
         import pitop
         print("Pitop detected! Use this on the computer >:(")
@@ -72,30 +218,37 @@ async def main():
     except ImportError:
         print("Pitop not detected")
     ip = input("Enter the Pi-Top IP address (default: 100.87.152.13): ").strip() or "100.87.152.13"
-    ownip = input("Enter your computer's IP address (for OBJDET, default: 100.118.119.120):").strip() or "100.118.119.120"
-    choice = input("What project u wanna run? (OBJDET/LNFOL/RC/USM) ").strip().upper()
+    ownip = input("Enter your computer's IP address (for OBJDET/LNFOL, default: 100.118.119.120):").strip() or "100.118.119.120"
+    choice = input("What project u wanna run? (OBJDET/LNFOL/RC/USM/BROKER) ").strip().upper()
 
     try:
         if choice == "OBJDET":
             print("[MAIN] Starting Object Detection locally + remotely...")
             await asyncio.gather(
                 run_color_isoc(),
-                ssh_run_remote("run_color_isos")
+                run_remote("run_color_isos", ownip, host=ip)
             )
 
         elif choice == "RC":
             print("[MAIN] Starting Remote Control system...")
             await asyncio.gather(
-                ssh_run_remote("run_remote_control_server"),
+                run_remote("run_remote_control_server", host=ip),
                 run_remote_control_client(ip)
             )
 
         elif choice == "USM":
             print("[MAIN] Starting Ultrasonic remotely...")
-            await ssh_run_remote("run_ultrasonic")
+            await run_remote("run_ultrasonic", host=ip)
 
         elif choice == "LNFOL":
-            print("not yet beta >:(")
+            print("[MAIN] Starting Line Following locally + remotely...")
+            await asyncio.gather(
+                run_line_followc(),
+                run_remote("run_line_follows", ownip, host=ip)
+            )
+        elif choice == "BROKER":
+            print("[MAIN] Starting the hardware broker remotely...")
+            await ssh_run_remote("run_broker", host=ip)
         else:
             print("nuh uh")
 